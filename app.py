@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 import base64
 from urllib.parse import quote as urlquote
-import os, re, json
+import os, re, json, threading, time
 
 import dash, dash_table
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
-from flask import Flask, send_from_directory
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from flask import Flask, Response, send_from_directory, request, jsonify, abort
+from werkzeug.utils import secure_filename
 from dash.exceptions import PreventUpdate
 
 import plotly.graph_objs as go
@@ -15,6 +16,9 @@ import pandas as pd
 from datetime import datetime as dt
 from datetime import date, timedelta
 import aux_methods as aux
+from datastore import DailyRollup, Dataset, DatasetStore, FigureCache, SharedDatasetStore
+from ingest import DirectoryWatcher, IngestQueue
+import metrics
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
@@ -36,6 +40,17 @@ def save_file(name, content):
             fp.write(base64.decodebytes(data))
 
 
+def stream_file(name, stream, chunk_size=1 << 16):
+    """Copy a file-like stream into the upload directory chunk by chunk, so memory use doesn't depend on its size."""
+    staged = os.path.join(STAGING_DIRECTORY, name)
+    with open(staged, "wb") as fp:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            fp.write(chunk)
+
+    # the file only shows up in the upload directory once it is complete
+    os.replace(staged, os.path.join(UPLOAD_DIRECTORY, name))
+
+
 def uploaded_files():
     """List the files in the upload directory."""
     files = []
@@ -45,12 +60,181 @@ def uploaded_files():
             files.append(filename)
     return files
 
+
+def refresh_dataset(progress=None):
+    """Publish the dataset in the upload directory, from the snapshot if the directory did not change since it was written.
+    Files added since are parsed and appended on their own, everything is loaded again only if they can't be (see aux.load_new_testresults()).
+    progress is called with the count of new files parsed, repaired and rejected so far."""
+    with INGEST_LOCK:
+        fingerprint = aux.directory_fingerprint(UPLOAD_DIRECTORY)
+        meta = aux.load_snapshot_meta(SNAPSHOT_DIRECTORY)
+        up_to_date = meta is not None and meta['fingerprint'] == fingerprint
+
+        if up_to_date and DATASETS.latest_version is not None:
+            return DATASETS.latest_version
+
+        # on boot, the dataset of the snapshot is published first
+        if meta is not None and DATASETS.latest_version is None:
+            version = publish_snapshot(meta)
+            if up_to_date:
+                return version
+
+        if meta is not None:
+            # the parsed rows of the history are not read, only those of the new files are needed
+            manifest = aux.load_manifest(MANIFEST_PATH, rows=False)
+            with metrics.timed_stage('load_new') as stage:
+                rows, added = aux.load_new_testresults(UPLOAD_DIRECTORY, manifest, meta['fingerprint'], n_jobs=PARSE_JOBS, progress=progress)
+                stage['rows'] = None if rows is None else len(rows)
+
+            if rows is not None:
+                # the snapshot is written first, the manifest is only taken as up to date with it once both are
+                with metrics.timed_stage('append_snapshot', len(rows)):
+                    meta = aux.append_snapshot(rows, SNAPSHOT_DIRECTORY, fingerprint)
+                    manifest['fingerprint'] = fingerprint
+                    aux.append_manifest(manifest, added, MANIFEST_PATH)
+
+                if not len(rows):
+                    return DATASETS.latest_version
+
+                rollup, since = recent_history(meta) if HISTORY_DAYS else (None, None)
+                with metrics.timed_stage('publish', len(rows)):
+                    return DATASETS.append(rows, rollup=rollup, since=since)
+
+        # files were changed or removed (or a new one changes how an older timestamp was repaired): everything is loaded
+        # again, the files already parsed into the manifest above are not parsed twice
+        with metrics.timed_stage('load'):
+            df = aux.load_testresults_todataframe(UPLOAD_DIRECTORY, manifest_path=MANIFEST_PATH, n_jobs=PARSE_JOBS, progress=progress,
+                                                  fingerprint=fingerprint, manifest=manifest if meta is not None else None)
+
+        with metrics.timed_stage('save_snapshot', len(df)):
+            meta = aux.save_snapshot(df, SNAPSHOT_DIRECTORY, fingerprint)
+
+        if HISTORY_DAYS:
+            rollup, since = recent_history(meta)
+            df = df[(df.created_at >= since).values] if since is not None else df
+
+            with metrics.timed_stage('publish', len(df)):
+                return DATASETS.publish(df, rollup=rollup, since=since)
+
+        with metrics.timed_stage('publish', len(df)):
+            return DATASETS.publish(df)
+
+
+def recent_history(meta):
+    """Rollup of the whole history of the snapshot and the first of the last HISTORY_DAYS days (None if it has no rows)."""
+    rollup = DailyRollup.from_partitions(meta)
+    since = rollup.last_day - timedelta(days=HISTORY_DAYS - 1) if len(rollup.states) else None
+
+    return rollup, since
+
+
+def publish_snapshot(meta):
+    """Publish the dataset of the snapshot, only its last HISTORY_DAYS days (read from the partitions they span) if set, with the rollup of the whole history."""
+    rollup, since = recent_history(meta) if HISTORY_DAYS else (None, None)
+
+    with metrics.timed_stage('load_snapshot') as stage:
+        df = aux.load_snapshot(SNAPSHOT_DIRECTORY, start=since)
+        stage['rows'] = None if df is None else len(df)
+
+    # a snapshot of an empty directory has no rows (nor columns)
+    df = aux.build_testresults_dataframe([]) if df is None else df
+
+    with metrics.timed_stage('publish', len(df)):
+        return DATASETS.publish(df, rollup=rollup, since=since)
+
+
+def window_dataset(dataset, start, end):
+    """Dataset holding the rows tested from start to end: the dataset itself, or the snapshot partitions the range overlaps if it starts before the history kept in memory."""
+    if dataset.covers(start):
+        return dataset
+
+    with metrics.timed_stage('load_window') as stage:
+        df = aux.load_snapshot(SNAPSHOT_DIRECTORY, start=start, end=end)
+        stage['rows'] = len(df)
+
+    return Dataset(dataset.version, aux.to_compact(df.set_index('created_at')).sort_index(kind='mergesort'), dataset.rollup)
+
+
+def run_ingest_job(job):
+    """Ingest the files of a job of the ingestion queue and log how long they took to show up in a published version."""
+    landed = []
+    for name in job.files:
+        try:
+            landed.append(os.stat(os.path.join(UPLOAD_DIRECTORY, name)).st_mtime)
+        except OSError:
+            pass
+
+    # the new version is only published once it is complete, dashboards keep showing the previous one until then
+    version = refresh_dataset(job.report)
+
+    if landed:
+        print('INGEST_LATENCY: {:.2f}s for {} files (version {}, job {})'.format(time.time() - min(landed), len(landed), version, job.id))
+
+    return version
+
+
+def ingest_new_files(names):
+    """Queue the files reported by the directory watcher for ingestion."""
+    JOBS.submit(sorted(names), source='watcher')
+
 # --------------------------------------------------------------------- #
 
 UPLOAD_DIRECTORY = "./Data/"
 
-if not os.path.exists(UPLOAD_DIRECTORY):
-    os.makedirs(UPLOAD_DIRECTORY)
+# streamed uploads are written here first and moved to UPLOAD_DIRECTORY once complete
+STAGING_DIRECTORY = "./.cache/incoming/"
+
+# parsed rows of every file in UPLOAD_DIRECTORY, so uploads only parse the new files
+MANIFEST_PATH = "./.cache/manifest.json"
+
+# columnar copy of the parsed dataset, the dashboard boots from it instead of reparsing UPLOAD_DIRECTORY
+SNAPSHOT_DIRECTORY = "./.cache/snapshot/"
+
+# how often open dashboards check for a new version of the dataset [ms]
+VERSION_POLL_INTERVAL = int(os.environ.get('VERSION_POLL_INTERVAL', 2000))
+
+# new files in UPLOAD_DIRECTORY are ingested in the background (set WATCH_UPLOADS=0 to turn it off)
+WATCH_UPLOADS = os.environ.get('WATCH_UPLOADS', '1') != '0'
+
+# days of history kept in memory (0 keeps all of it), older date ranges are read from the snapshot partitions they overlap
+HISTORY_DAYS = int(os.environ.get('HISTORY_DAYS', 0))
+
+# number of processes used to parse new files (opt-in, 1 parses them in the callback's own process)
+PARSE_JOBS = int(os.environ.get('PARSE_JOBS', 1))
+
+# with SHARED_DATASET=1 (multi-process servers, see the Procfile) a single worker parses and publishes the dataset as
+# memory-mapped files in SHARED_DIRECTORY, and every worker attaches to them instead of holding its own copy
+SHARED_DATASET = os.environ.get('SHARED_DATASET', '0') != '0'
+SHARED_DIRECTORY = "./.cache/shared/"
+
+for directory in [UPLOAD_DIRECTORY, STAGING_DIRECTORY]:
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+# parsed datasets live on the server, the browser only gets their version token
+DATASETS = SharedDatasetStore(SHARED_DIRECTORY) if SHARED_DATASET else DatasetStore()
+INGEST_LOCK = threading.Lock()
+
+# uploads and files picked up by the directory watcher are ingested by a background job, one job at a time
+# (in the loader process when the dataset is shared, the other workers submit their jobs through the spool directory)
+JOBS = IngestQueue(run_ingest_job, spool=os.path.join(SHARED_DIRECTORY, 'jobs') if SHARED_DATASET else None)
+
+# figures of graph1 for the latest (version, dates, selection, mode) combinations
+FIGURES = FigureCache(max_size=int(os.environ.get('FIGURE_CACHE_SIZE', 256)), max_age=int(os.environ.get('FIGURE_CACHE_AGE', 900)))
+
+# rows per page of the device table
+TABLE_PAGE_SIZE = int(os.environ.get('TABLE_PAGE_SIZE', 25))
+
+# with LIVE_OVERVIEW=1 a new version of the dataset only sends the browser the counts of the days it changed and the rows
+# appended since the version it has, the overview chart and the windrose of graph1 are updated in place (see assets/live.js)
+LIVE_OVERVIEW = os.environ.get('LIVE_OVERVIEW', '0') != '0'
+
+# with CLIENTSIDE_OVERVIEW=1 the browser gets the daily counts once per version of the dataset and filters the overview
+# chart itself (see assets/overview.js), the server is only asked for the device view. Implied by LIVE_OVERVIEW.
+CLIENTSIDE_OVERVIEW = os.environ.get('CLIENTSIDE_OVERVIEW', '0') != '0' or LIVE_OVERVIEW
+
+# above this many devices the windrose of graph1 shows density bins instead of one marker per device
+WINDROSE_POINT_BUDGET = int(os.environ.get('WINDROSE_POINT_BUDGET', aux.WINDROSE_POINT_BUDGET))
 
 
 # Normally, Dash creates its own Flask server internally. By creating our own,
@@ -59,6 +243,71 @@ server = Flask(__name__)
 app = dash.Dash(server=server,external_stylesheets=external_stylesheets)
 app.config['suppress_callback_exceptions'] = True
 
+# ---------------- UPLOAD ROUTES -------------------------- #
+
+@server.route("/upload", methods=["POST"])
+def upload_files():
+    """Store the files of a multipart upload (any field name) and queue them for ingestion."""
+    names = []
+    for storage in request.files.values():
+        name = secure_filename(storage.filename)
+        if name:
+            stream_file(name, storage.stream)
+            names.append(name)
+
+    if not names:
+        abort(400, "no files in the request")
+
+    return jsonify(files=names, job=JOBS.submit(names)), 202
+
+
+@server.route("/upload/<name>", methods=["PUT"])
+def upload_file(name):
+    """Store a single file sent as the raw (possibly chunked) request body and queue it for ingestion."""
+    name = secure_filename(name)
+    if not name:
+        abort(400, "invalid file name")
+
+    stream_file(name, request.stream)
+
+    return jsonify(files=[name], job=JOBS.submit([name])), 202
+
+
+@server.route("/jobs/<job_id>")
+def ingest_job(job_id):
+    """Status of an ingestion job: files parsed, repaired and rejected so far, and the version it published once done."""
+    job = JOBS.job(job_id)
+    if job is None:
+        abort(404, "unknown job")
+
+    return jsonify(job.to_dict())
+
+# ---------------- METRICS ROUTE -------------------------- #
+
+metrics.REGISTRY.register(metrics.Gauge('orion_figure_cache', 'Figure cache size, hits, misses and evictions',
+                                        lambda: {(k,): v for k, v in FIGURES.stats().items()}, ('stat',)))
+metrics.REGISTRY.register(metrics.Gauge('orion_dataset_rows', 'Rows in the latest published dataset',
+                                        lambda: {(): len(DATASETS.get())} if DATASETS.latest_version else {}))
+
+@server.after_request
+def record_response_size(response):
+    # callback responses are labelled with the component they update
+    if request.path.endswith('_dash-update-component'):
+        route = (request.get_json(silent=True) or {}).get('output', 'unknown')
+    else:
+        route = request.url_rule.rule if request.url_rule is not None else 'unknown'
+
+    if not response.direct_passthrough:
+        metrics.RESPONSE_BYTES.observe(response.calculate_content_length() or 0, route)
+
+    return response
+
+
+@server.route("/metrics")
+def export_metrics():
+    """Latency, row count and payload size histograms in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 # ---------------- DASHBOARD LAYOUT -------------------------- #
 
 # custom layout ---------------------------------------------- #
@@ -86,6 +335,71 @@ app.index_string = '''
 # colorscheme ------------------------------------------------ #
 colors = dict(darkest='#344b52', darker='#597f8a', lightest='#f5f5f5', pastel='#cfd3ca', lighter='#a1bdc2')
 
+# states that can be picked in failure rate mode
+STATE_OPTIONS = [{'label': ' '.join(i.split('_')).title(), 'value': i} for i in ['passed', 'failed_1', 'failed_2', 'failed_3', 'failed_all']]
+
+def device_dropdown(options=None):
+    return dcc.Dropdown(id='dropdown-select', multi=True, options=options or [])
+
+def device_panels():
+    return html.Div(
+        id='main-div',
+        className='3 rows container',
+        style=dict(backgroundColor=colors['lightest'], display='flex', width='100%'), 
+        children=[
+            
+            html.Div(
+                id='graph-div',
+                className='item',
+                style=dict(
+                    backgroundColor=colors['lightest'],
+                    order=1,
+                ),
+                children=[dcc.Graph(id='graph1'),]
+            ),
+            
+            html.Div(
+                className='item',
+                style=dict(
+                    backgroundColor=colors['lightest'],
+                    order=2,
+                ), 
+                children=[
+                    html.Div(id='datatable-div',style=dict(display='none'),children=[dash_table.DataTable(
+                        id='datatable', data=[], columns=[{}],
+                        # paging, sorting and filtering run on the server, only the visible page is sent
+                        pagination_mode='be', pagination_settings=dict(current_page=0, page_size=TABLE_PAGE_SIZE),
+                        sorting='be', sort_by=[],
+                        filtering='be', filter='',
+                    ),
+                    # backend paging leaves the table without a page count, it is shown here
+                    html.Div(id='datatable-pages', style=dict(fontSize='12px', color=colors['darker'])),
+                    ])]    
+            ),
+        ])
+
+def clientside_overview():
+    '''
+    Overview chart drawn in the browser from the daily counts, and the container the device view is rendered into
+    '''
+    return [
+        dcc.Store(id='daily-counts'),
+
+        # in live mode, what changed with the last version (see update_live_delta()) and the version the browser is at
+        *([dcc.Store(id='live-delta'), dcc.Store(id='live-version')] if LIVE_OVERVIEW else []),
+
+        html.Div(
+            id='overview-div',
+            children=[
+                dcc.Dropdown(id='state-select', multi=True, options=STATE_OPTIONS),
+                dcc.Graph(id='overview-graph'),
+            ]
+        ),
+
+        # only in the layout while devices are shown, so the server-side callbacks of the device view don't run otherwise
+        html.Div(id='device-view'),
+    ]
+
 # HTMLish ---------------------------------------------------- #
 app.layout = html.Div(style=dict(backgroundColor=colors['lightest']), children=[
     html.Div(
@@ -97,9 +411,12 @@ app.layout = html.Div(style=dict(backgroundColor=colors['lightest']), children=[
         ]
     ),
     
-    # invisible div to save the dataframe
+    # invisible div to save the version of the dataframe held in DATASETS
     html.Div(id='dataframe', style={'display': 'none'}),
 
+    # checks for new versions of the dataframe (e.g. files picked up by the directory watcher)
+    dcc.Interval(id='version-poll', interval=VERSION_POLL_INTERVAL),
+
     html.Div(
         className='3 rows',
         style=dict(backgroundColor=colors['lightest']),    
@@ -139,6 +456,10 @@ app.layout = html.Div(style=dict(backgroundColor=colors['lightest']), children=[
                     ["Drop file or click to select"]
                 ),
                 multiple=True),
+
+            # id of the ingestion job of the last upload and its progress
+            dcc.Store(id='ingest-job'),
+            html.Div(id='ingest-progress', style=dict(float='right', clear='right', fontSize='12px', color=colors['darker'])),
         ]
     ),
     
@@ -158,38 +479,12 @@ app.layout = html.Div(style=dict(backgroundColor=colors['lightest']), children=[
                 labelStyle={'display': 'inline-block'}
             ),
             
-            dcc.Dropdown(id='dropdown-select',multi=True)
+            # in clientside mode the dropdown of devices comes with the device view
+            *([] if CLIENTSIDE_OVERVIEW else [device_dropdown()])
         ]
     ),
 
-    html.Div(
-        id='main-div',
-        className='3 rows container',
-        style=dict(backgroundColor=colors['lightest'], display='flex', width='100%'), 
-        children=[
-            
-            html.Div(
-                id='graph-div',
-                className='item',
-                style=dict(
-                    backgroundColor=colors['lightest'],
-                    order=1,
-                ),
-                children=[dcc.Graph(id='graph1'),]
-            ),
-            
-            html.Div(
-                className='item',
-                style=dict(
-                    backgroundColor=colors['lightest'],
-                    order=2,
-                ), 
-                children=[
-                    html.Div(id='datatable-div',style=dict(display='none'),children=[dash_table.DataTable(id='datatable', data=[],columns=[{}])])]    
-            ),
-        ]),
-    
-
+    *(clientside_overview() if CLIENTSIDE_OVERVIEW else [device_panels()])
 ])
 
 # ---------------- DASHBOARD INTERACTIONS ------------------------ #
@@ -202,13 +497,17 @@ app.layout = html.Div(style=dict(backgroundColor=colors['lightest']), children=[
         Output('date-range-picker', 'max_date_allowed')],
         [Input('dataframe', 'children')]
 )
-def update_datepicker(json_df):
-    # sets 'created_at' as DatetimeIndex (necessary for the auxiliary methods in aux_methods.py)
-    df = pd.read_json(json_df, orient='split')
-    df.set_index('created_at', inplace=True)
-    df.sort_index(kind='mergesort', inplace=True) 
+@metrics.timed_callback('update_datepicker')
+def update_datepicker(version):
+    # the bounds come from the daily rollup, no need to look at the rows
+    rollup = DATASETS.rollup(version)
+    if not len(rollup.states):
+        # nothing ingested yet, the picker keeps its defaults
+        raise PreventUpdate
+
+    first, last = rollup.first_day, rollup.last_day
     
-    return dt(df.index.max().year, df.index.max().month, 1), df.index.max().date() - timedelta(days=15),df.index.max().date() + timedelta(days=1), df.index.min().date(), df.index.max().date() + timedelta(days=1)
+    return dt(last.year, last.month, 1), last.date() - timedelta(days=15), last.date() + timedelta(days=1), first.date(), last.date() + timedelta(days=1)
 
 
 @app.callback(
@@ -216,76 +515,129 @@ def update_datepicker(json_df):
     [Input('dataframe', 'children'),Input('radio-select', 'value'),Input('date-range-picker', 'start_date'),Input('date-range-picker', 'end_date')],
     [State('dropdown-select', 'value')]
 )
-def update_dropdown_states(json_df, mode, start_date, end_date, previous_selection):
+@metrics.timed_callback('update_dropdown_states')
+def update_dropdown_states(version, mode, start_date, end_date, previous_selection):
     '''
     '''
     if previous_selection:
         pass
 
-    # sets 'created_at' as DatetimeIndex (necessary for the auxiliary methods in aux_methods.py)
-    df = pd.read_json(json_df, orient='split')
-    df.set_index('created_at', inplace=True)
-    df.sort_index(kind='mergesort', inplace=True) 
-    
     start = dt.strptime(start_date, '%Y-%m-%d')
     end = dt.strptime(end_date, '%Y-%m-%d')
 
     if mode == 'f_rate':
-        return [{'label': ' '.join(i.split('_')).title(), 'value': i} for i in ['passed', 'failed_1', 'failed_2', 'failed_3', 'failed_all']], []
+        return STATE_OPTIONS, []
 
     elif mode == 'd_specs':
         if start is not None and end is not None:
-            return [{'label': i.title(), 'value': i} for i in df.loc[start : end].id.values], []
+            return device_options(version, start, end), []
+
+
+def device_options(version, start, end):
+    """Options of the device dropdown: the devices tested from start to end."""
+    df = window_dataset(DATASETS.dataset(version), start, end).window(start, end + timedelta(days=1))
 
+    # a device tested several times is listed once
+    return [{'label': i.title(), 'value': i} for i in pd.unique(df.id.values)]
+
+
+# in live mode graph1 follows the version of the live delta, it is only rebuilt when the browser can't append the new rows
+GRAPH1_VERSION = dash.dependencies.Input('live-version', 'data') if LIVE_OVERVIEW else dash.dependencies.Input('dataframe', 'children')
 
 @app.callback(
     dash.dependencies.Output('graph1', 'figure'),
     [
-        dash.dependencies.Input('dataframe', 'children'),
+        GRAPH1_VERSION,
         dash.dependencies.Input('date-range-picker', 'start_date'),
         dash.dependencies.Input('date-range-picker', 'end_date'),
         dash.dependencies.Input('dropdown-select', 'value'),
         dash.dependencies.Input('radio-select', 'value'),
     ]
 )
-def update_graph1(json_df, start_date, end_date, in_focus, mode):
+@metrics.timed_callback('update_graph1')
+def update_graph1(version, start_date, end_date, in_focus, mode):
     '''
     '''
-    # sets 'created_at' as DatetimeIndex (necessary for the auxiliary methods in aux_methods.py)
-    df = pd.read_json(json_df, orient='split')
-    df.set_index('created_at', inplace=True)
-    df.sort_index(kind='mergesort', inplace=True) 
+    live = version if LIVE_OVERVIEW else None
+    if live:
+        version = live['version']
+
+    # the stored frame is indexed by 'created_at' and sorted (necessary for the auxiliary methods in aux_methods.py)
+    dataset = DATASETS.dataset(version)
     
     # transform into datetime.date object
     start = dt.strptime(start_date, '%Y-%m-%d')
     end = dt.strptime(end_date, '%Y-%m-%d')
 
+    # the same figure is requested over and over by everyone looking at the same line
+    key = (dataset.version, start, end, tuple(sorted(in_focus or [])), mode)
+
     if mode == 'f_rate':
-        return aux.update_barplot(df, start, end, in_focus)
+        return FIGURES.get_or_build(key, lambda: aux.update_barplot_from_counts(dataset.rollup.window(start, end), in_focus))
 
     elif mode == 'd_specs':
-        return aux.update_windroseplot(df, start, end, in_focus)
+        # a new live version is appended to the windrose in the browser when it can be (see assets/live.js)
+        triggers = [x['prop_id'] for x in dash.callback_context.triggered]
+        if live and triggers == ['live-version.data'] and windrose_appendable(live, start, end, in_focus):
+            raise PreventUpdate
+
+        def build():
+            # the date range is found by binary search and the devices in focus in the device index, no scan of the frame
+            frame = window_dataset(dataset, start, end).window(start, end + timedelta(days=1), ids=in_focus)
+            figure = aux.update_windroseplot(frame, start, end, None, point_budget=WINDROSE_POINT_BUDGET)
+
+            # tells the browser which version the figure shows, rows of later versions are appended to it
+            figure['layout'].datarevision = dataset.version
+
+            return figure
+
+        return FIGURES.get_or_build(key, build)
 
 
 @app.callback(
-    Output('dataframe', 'children'),
-    [Input('upload-data', 'filename'), Input('upload-data', 'contents')],
+    Output('ingest-job', 'data'),
+    [Input('upload-data', 'filename'), Input('upload-data', 'contents')]
 )
-def parse_inputfiles(fnames_to_upload: list, fcontent_to_upload: list) -> pd.DataFrame:
+@metrics.timed_callback('submit_upload')
+def submit_upload(fnames_to_upload: list, fcontent_to_upload: list) -> str:
     '''
     '''
+    if not (fnames_to_upload and fcontent_to_upload):
+        raise PreventUpdate
+
     # load files in the 'tmp/' folder
-    files_indisk = uploaded_files()  
-    path = 'Data/'  
+    files_indisk = uploaded_files()
 
-    if fnames_to_upload and fcontent_to_upload:
-        
-        for name, data in zip(fnames_to_upload, fcontent_to_upload):
-            if name not in files_indisk:
-                save_file(name, data)
+    for name, data in zip(fnames_to_upload, fcontent_to_upload):
+        if name not in files_indisk:
+            save_file(name, data)
+
+    # parsing is left to the ingestion queue, the new version is picked up by parse_inputfiles() once published
+    return JOBS.submit(fnames_to_upload)
+
+
+@app.callback(
+    Output('dataframe', 'children'),
+    [Input('version-poll', 'n_intervals')],
+    [State('dataframe', 'children')]
+)
+@metrics.timed_callback('parse_inputfiles')
+def parse_inputfiles(n_intervals: int, current_version: str) -> str:
+    '''
+    '''
+    # a poll only swaps in a newer version, ingestion of new files is left to the ingestion queue
+    if DATASETS.latest_version is not None:
+        if DATASETS.latest_version == current_version:
+            raise PreventUpdate
+
+        return DATASETS.latest_version
+
+    # workers sharing the dataset wait for the loader to publish it
+    if not DATASETS.is_loader:
+        raise PreventUpdate
 
     try:
-        return aux.load_testresults_todataframe(path).to_json(date_format='iso', orient='split')
+        return refresh_dataset()
     
     except Exception as e:
         print('PARSE_INPUT_ERROR:', e)
@@ -293,35 +645,212 @@ def parse_inputfiles(fnames_to_upload: list, fcontent_to_upload: list) -> pd.Dat
 
 
 @app.callback(
-    [Output('datatable', 'data'),Output('datatable', 'columns'), Output('datatable-div', 'style'), Output('graph-div', 'style')],
-    [Input('graph1', 'clickData'),Input('dropdown-select', 'value')],
-    [State('dataframe', 'children'),State('radio-select', 'value')]
+    Output('ingest-progress', 'children'),
+    [Input('version-poll', 'n_intervals'), Input('ingest-job', 'data')]
 )
-def update_table(clickData, dropdown_select, json_df, radio):
+@metrics.timed_callback('update_ingest_progress')
+def update_ingest_progress(n_intervals, job_id):
+    '''
+    '''
+    job = JOBS.job(job_id) if job_id else None
+    if job is None:
+        raise PreventUpdate
+
+    progress = '{} files: {} parsed, {} repaired, {} rejected'.format(len(job.files), job.parsed, job.repaired, job.rejected)
+
+    if job.status == 'done':
+        return 'Upload ingested ({}), version {}'.format(progress, job.version)
+
+    elif job.status == 'failed':
+        return 'Upload failed ({}): {}'.format(progress, job.error)
+
+    return 'Upload {} ({})'.format(job.status, progress)
+
+
+@app.callback(
+    [Output('datatable', 'data'),Output('datatable', 'columns'), Output('datatable-pages', 'children'), Output('datatable-div', 'style'), Output('graph-div', 'style')],
+    [Input('graph1', 'clickData'),Input('dropdown-select', 'value'),
+     Input('datatable', 'pagination_settings'), Input('datatable', 'sort_by'), Input('datatable', 'filter')],
+    [State('dataframe', 'children'),State('radio-select', 'value'),State('date-range-picker', 'start_date'),State('date-range-picker', 'end_date')]
+)
+@metrics.timed_callback('update_table')
+def update_table(clickData, dropdown_select, pagination_settings, sort_by, table_filter, version, radio, start_date, end_date):
     '''
     '''
     if 'd_specs' in radio and (dropdown_select or clickData):
         if clickData or dropdown_select:
-            df = pd.read_json(json_df, orient='split').drop(columns=['created_at'], errors='ignore') 
+            dataset = DATASETS.dataset(version)
+            start, end = dt.strptime(start_date, '%Y-%m-%d'), dt.strptime(end_date, '%Y-%m-%d')
+
+            # devices picked before the history kept in memory are looked up in the partitions of the date range
+            dataset = window_dataset(dataset, start, end)
             
             if dropdown_select:
                 # pick the devices selected in the dropdown option
-                df = df.loc[[True if str(x) in dropdown_select else False for x in df.id]]
+                df = dataset.rows(dropdown_select)
             
             elif clickData:
-                df = df.loc[df.id==clickData['points'][0]['text'].split(' ',1)[1]]
+                # binned markers ('N devices') don't point to a single device
+                text = clickData['points'][0].get('text', '')
+                if not text.startswith('Id: '):
+                    raise PreventUpdate
+
+                df = dataset.rows([text.split(' ',1)[1]])
+
+            pagination_settings = pagination_settings or dict(current_page=0, page_size=TABLE_PAGE_SIZE)
+            df = aux.sort_table(aux.filter_table(df, table_filter), sort_by)
+            page, current_page, n_pages = aux.table_page(
+                df,
+                pagination_settings.get('current_page', 0),
+                pagination_settings.get('page_size', TABLE_PAGE_SIZE),
+            )
+            pages = 'Page {} of {} ({} rows)'.format(current_page + 1, n_pages, len(df))
+
+            # only the rows of the page are converted back from the compact layout
+            page = aux.from_compact(page)
             
-            return df.to_dict('records'), [{"name": i, "id": i} for i in df.columns if i!='created_at'], dict(display='inline-block'), dict(className='item', alignSelf='flex-start')
+            return page.to_dict('records'), [{"name": i, "id": i} for i in page.columns if i!='created_at'], pages, dict(display='inline-block'), dict(className='item', alignSelf='flex-start')
     
     elif 'f_rate' in radio:
-        return [], [], dict(display='none'), dict(className='item', alignSelf='center',)
+        return [], [], '', dict(display='none'), dict(className='item', alignSelf='center',)
 
     else:
         raise PreventUpdate
 
 
+# ---------------- CLIENTSIDE OVERVIEW ------------------------ #
+
+if CLIENTSIDE_OVERVIEW and not LIVE_OVERVIEW:
+    @app.callback(Output('daily-counts', 'data'), [Input('dataframe', 'children')])
+    @metrics.timed_callback('update_daily_counts')
+    def update_daily_counts(version):
+        '''
+        '''
+        # counts of the whole history, the date range and the states are picked in the browser
+        return aux.daily_counts_payload(DATASETS.rollup(version).states)
+
+
+if CLIENTSIDE_OVERVIEW:
+    @app.callback(
+        Output('device-view', 'children'),
+        [Input('radio-select', 'value')],
+        [State('dataframe', 'children'), State('date-range-picker', 'start_date'), State('date-range-picker', 'end_date')]
+    )
+    @metrics.timed_callback('render_device_view')
+    def render_device_view(mode, version, start_date, end_date):
+        '''
+        '''
+        if mode != 'd_specs':
+            return []
+
+        # the callbacks of the dropdown only run on later changes, so it comes with the devices of the current date range
+        start, end = dt.strptime(start_date[:10], '%Y-%m-%d'), dt.strptime(end_date[:10], '%Y-%m-%d')
+        return [device_dropdown(device_options(version, start, end)), device_panels()]
+
+
+    app.clientside_callback(
+        ClientsideFunction('overview', 'figure'),
+        Output('overview-graph', 'figure'),
+        [Input('daily-counts', 'data'), Input('date-range-picker', 'start_date'), Input('date-range-picker', 'end_date'), Input('state-select', 'value')]
+    )
+
+    app.clientside_callback(
+        ClientsideFunction('overview', 'display'),
+        Output('overview-div', 'style'),
+        [Input('radio-select', 'value')]
+    )
+
+
+# ---------------- LIVE OVERVIEW ------------------------ #
+
+if LIVE_OVERVIEW:
+    @app.callback(
+        [Output('live-delta', 'data'), Output('live-version', 'data')],
+        [Input('dataframe', 'children')],
+        [State('live-version', 'data')]
+    )
+    @metrics.timed_callback('update_live_delta')
+    def update_live_delta(version, live):
+        '''
+        '''
+        dataset = DATASETS.dataset(version)
+        if dataset is None or (live and live['version'] == dataset.version):
+            raise PreventUpdate
+
+        # the version the browser has, if it is still held and the new rows were appended to it
+        previous = DATASETS.held(live['version']) if live else None
+        appended = dataset.appended_since(previous) if previous is not None else None
+
+        if appended is None:
+            # first version of the page, or older results came in: the counts of the whole history
+            delta = dict(version=dataset.version, base=None, payload=aux.daily_counts_payload(dataset.rollup.states))
+
+        else:
+            # the counts of the days the new rows were tested on, and the rows themselves unless there are too many to draw one by one
+            delta = dict(version=dataset.version, base=previous.version,
+                         counts=aux.daily_counts_delta(dataset.rollup.states, appended.index),
+                         rows=aux.windrose_delta(appended) if len(appended) <= WINDROSE_POINT_BUDGET else None)
+
+        return delta, dict(version=dataset.version, base=delta['base'], appended=delta.get('rows') is not None)
+
+
+    def windrose_appendable(live, start, end, in_focus):
+        '''
+        True if the browser can append the rows of the live delta to the windrose it shows instead of getting a new figure
+        '''
+        previous, dataset = DATASETS.held(live['base']), DATASETS.held(live['version'])
+        if not live['appended'] or previous is None or dataset is None or not previous.covers(start):
+            return False
+
+        before = previous.window(start, end + timedelta(days=1), ids=in_focus)
+        after = dataset.window(start, end + timedelta(days=1), ids=in_focus)
+
+        # a binned figure, a switch to WebGL or a state without a trace yet need a new figure
+        if len(after) > WINDROSE_POINT_BUDGET or (len(before) > aux.WINDROSE_GL_POINTS) != (len(after) > aux.WINDROSE_GL_POINTS):
+            return False
+
+        return set(after.state.iloc[len(before):].astype(str)) <= set(before.state.astype(str))
+
+
+    app.clientside_callback(
+        ClientsideFunction('live', 'counts'),
+        Output('daily-counts', 'data'),
+        [Input('live-delta', 'data')],
+        [State('daily-counts', 'data')]
+    )
+
+    app.clientside_callback(
+        ClientsideFunction('live', 'windrose'),
+        Output('graph1', 'extendData'),
+        [Input('live-delta', 'data')],
+        [State('date-range-picker', 'start_date'), State('date-range-picker', 'end_date'), State('dropdown-select', 'value')]
+    )
+
+
 # ---------------- MAIN ------------------------ #
 
+def start_loader():
+    """Publish the dataset and start ingesting new files."""
+    # boots from the snapshot (or builds it on the first run) so the first page load doesn't wait for the parser
+    try:
+        refresh_dataset()
+
+    except Exception as e:
+        # the app still comes up (and the files dropped later are still ingested), with an empty dataset
+        print('PARSE_INPUT_ERROR:', e)
+        DATASETS.publish(aux.build_testresults_dataframe([]))
+
+    JOBS.start()
+
+    if WATCH_UPLOADS:
+        DirectoryWatcher(UPLOAD_DIRECTORY, ingest_new_files).start()
+
+if SHARED_DATASET:
+    # one worker loads the dataset and ingests new files, the others attach to the versions it publishes
+    DATASETS.elect_loader(start_loader)
+else:
+    start_loader()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     #debug = os.environ.get('PRODUCTION') is None
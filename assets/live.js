@@ -0,0 +1,113 @@
+/*
+ * Live version of the overview (LIVE_OVERVIEW=1 in app.py).
+ * Every new version of the dataset comes as a delta from the version the browser has (see update_live_delta() in app.py):
+ * the counts of the days it changed, merged into the payload of the overview chart, and the rows appended since,
+ * appended to the windrose of graph1 through extendData instead of sending the whole figure again.
+ */
+
+// index of day in the sorted list of days, or where it would be inserted
+function bisect(days, day) {
+    var lo = 0;
+    var hi = days.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (days[mid] < day) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    return lo;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        counts: function (delta, payload) {
+            if (!delta) {
+                return payload || null;
+            }
+
+            // the whole history, on the first version or when older results came in
+            if (delta.payload) {
+                return Object.assign({version: delta.version}, delta.payload);
+            }
+
+            if (!payload || payload.version !== delta.base) {
+                return payload;
+            }
+
+            var days = payload.days.slice();
+            var counts = {};
+            delta.counts.states.forEach(function (state) {
+                counts[state] = payload.counts[state] ? payload.counts[state].slice() : days.map(function () { return 0; });
+            });
+
+            // counts are absolute, days tested on for the first time are inserted in order
+            delta.counts.days.forEach(function (day, k) {
+                var i = bisect(days, day);
+                if (days[i] !== day) {
+                    days.splice(i, 0, day);
+                    delta.counts.states.forEach(function (state) { counts[state].splice(i, 0, 0); });
+                }
+                delta.counts.states.forEach(function (state) { counts[state][i] = delta.counts.counts[state][k]; });
+            });
+
+            return Object.assign({}, payload, {version: delta.version, days: days, states: delta.counts.states, counts: counts});
+        },
+
+        windrose: function (delta, startDate, endDate, inFocus) {
+            var graph = document.getElementById('graph1');
+            if (!graph || !graph.data || !graph.layout) {
+                return undefined;
+            }
+
+            // figures built on the server carry their version as datarevision, the rows of later versions are appended to it
+            var live = graph._live;
+            if (!live || live.revision !== graph.layout.datarevision) {
+                live = graph._live = {revision: graph.layout.datarevision, version: graph.layout.datarevision, extension: undefined};
+            }
+
+            // returning the last extension again leaves the graph as it is
+            if (!delta || !delta.rows || delta.base !== live.version || !startDate || !endDate) {
+                return live.extension;
+            }
+            live.version = delta.version;
+
+            var start = startDate.slice(0, 10);
+            var end = endDate.slice(0, 10);
+            var focus = inFocus && inFocus.length ? inFocus : null;
+
+            // devices spiral outwards in the order they were tested, states without a trace get a new figure from the server
+            var update = {r: [], theta: [], text: []};
+            var indices = [];
+            var rows = delta.rows;
+            rows.states.forEach(function (state, k) {
+                if (rows.days[k] < start || rows.days[k] > end || (focus && focus.indexOf(rows.ids[k]) < 0)) {
+                    return;
+                }
+
+                var trace = graph.data.findIndex(function (x) { return x.name === state; });
+                if (trace < 0) {
+                    return;
+                }
+
+                var j = indices.indexOf(trace);
+                if (j < 0) {
+                    j = indices.push(trace) - 1;
+                    update.r.push([]);
+                    update.theta.push([]);
+                    update.text.push([]);
+                }
+
+                update.r[j].push((graph.data[trace].r.length + update.r[j].length) * 2 + 10);
+                update.theta[j].push(rows.angles[k]);
+                update.text[j].push('Id: ' + rows.ids[k]);
+            });
+
+            if (indices.length) {
+                live.extension = [update, indices];
+            }
+            return live.extension;
+        }
+    }
+});
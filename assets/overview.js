@@ -0,0 +1,122 @@
+/*
+ * Clientside version of the overview chart (CLIENTSIDE_OVERVIEW=1 in app.py).
+ * The server sends the daily counts once per dataset version (see aux_methods.daily_counts_payload()),
+ * date range and state filtering then run in the browser. Mirrors aux_methods.update_barplot_from_counts().
+ */
+var MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+
+// 'YYYY-MM-DD' -> 'Sep 01', like strftime('%b %d')
+function dayLabel(day) {
+    return MONTHS[parseInt(day.slice(5, 7), 10) - 1] + ' ' + day.slice(8, 10);
+}
+
+// like '{:.2f}'.format(x): exact halves are rounded to even, toFixed() rounds them up
+function fixed2(x) {
+    var scaled = x * 100;
+    var floor = Math.floor(scaled);
+    return (scaled - floor === 0.5 && floor % 2 === 0) ? (floor / 100).toFixed(2) : x.toFixed(2);
+}
+
+function std(values) {
+    if (!values.length) {
+        return 0;
+    }
+    var mean = values.reduce(function (a, b) { return a + b; }, 0) / values.length;
+    var variance = values.reduce(function (a, b) { return a + (b - mean) * (b - mean); }, 0) / values.length;
+    return Math.sqrt(variance);
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    overview: {
+        figure: function (payload, startDate, endDate, inFocus) {
+            if (!payload || !startDate || !endDate) {
+                return {data: [], layout: {}};
+            }
+
+            // the picker sends dates, or datetimes once they have been picked
+            var start = startDate.slice(0, 10);
+            var end = endDate.slice(0, 10);
+            var focus = inFocus && inFocus.length ? inFocus : null;
+
+            var states = payload.states.filter(function (state) {
+                return !focus || focus.indexOf(state) >= 0;
+            });
+
+            // days and states without any device are left out
+            var rows = [];
+            payload.days.forEach(function (day, i) {
+                if (day < start || day > end) {
+                    return;
+                }
+                var counts = states.map(function (state) { return payload.counts[state][i]; });
+                if (counts.some(function (x) { return x > 0; })) {
+                    rows.push({day: day, counts: counts});
+                }
+            });
+            var shown = states.filter(function (state, j) {
+                return rows.some(function (row) { return row.counts[j] > 0; });
+            });
+
+            var data = shown.map(function (state) {
+                var j = states.indexOf(state);
+                var days = rows.filter(function (row) { return row.counts[j] > 0; });
+                var y = days.map(function (row) { return row.counts[j]; });
+                return {
+                    type: 'bar',
+                    x: days.map(function (row) { return dayLabel(row.day); }),
+                    y: y,
+                    text: y.map(String),
+                    hoverinfo: 'text',
+                    textposition: 'auto',
+                    opacity: 1,
+                    marker: {color: payload.colors[state] || payload.colors.failed_all},
+                    name: state
+                };
+            });
+
+            // failure rate of each day, over the states shown
+            var showFailRate = !focus || (focus.some(function (x) { return x.indexOf('failed') >= 0; }) &&
+                                          focus.some(function (x) { return x.indexOf('passed') >= 0; }));
+            if (showFailRate) {
+                var x = [];
+                var rates = [];
+                rows.forEach(function (row) {
+                    var failed = 0;
+                    var passed = 0;
+                    shown.forEach(function (state) {
+                        var n = row.counts[states.indexOf(state)];
+                        if (state.indexOf('fail') >= 0) {
+                            failed += n;
+                        } else if (state === 'passed') {
+                            passed += n;
+                        }
+                    });
+                    if (failed + passed > 0) {
+                        x.push(dayLabel(row.day));
+                        rates.push(failed / (failed + passed) * 100);
+                    }
+                });
+
+                var deviation = std(rates);
+                data.push({
+                    type: 'scatter',
+                    mode: 'lines',
+                    x: x,
+                    y: rates,
+                    name: 'Fail Rate ± Standard Deviation',
+                    hoverinfo: 'text',
+                    text: rates.map(function (rate) { return fixed2(rate) + '% ± ' + fixed2(deviation); }),
+                    yaxis: 'y2',
+                    error_y: {type: 'percent', value: deviation, visible: true},
+                    marker: {color: '#c97b42'}
+                });
+            }
+
+            return {data: data, layout: payload.layout};
+        },
+
+        display: function (mode) {
+            return {display: mode === 'f_rate' ? 'block' : 'none'};
+        }
+    }
+});
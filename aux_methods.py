@@ -1,22 +1,28 @@
-import os, re
+import os, re, io, json, hashlib, shutil, zipfile, tarfile
 import pandas as pd
-from collections import OrderedDict
+from pandas.api.types import union_categoricals
+from collections import OrderedDict, Counter
 import numpy as np
 from typing import Any
 from datetime import datetime as dt
 from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
 import plotly.graph_objs as go
 
+from metrics import timed_stage
+
 # ---------------------- AUX METHODS FOR PARSER -------------------------- #
-def parse_test_results(fname):
+def parse_test_results(fname, path='Data/', from_file=None):
     '''
+    Reads path/fname, unless its content is given in from_file (e.g. a member of an archive)
     '''
     min_pattern = ['response bad', 'polarity bad', 'rub+buzz bad', 'thd bad', 'created_at 17.10.2018 13.07.41', 'unit n. f072-00737 bad']
     main_features = ['response', 'polarity', 'rub+buzz', 'thd']
     timestamp = re.compile(r'(\d+\.){2}\d+')
     
-    with open('Data/{}'.format(fname), 'r') as f:
-        from_file = f.read()
+    if from_file is None:
+        with open(os.path.join(path, fname), 'r') as f:
+            from_file = f.read()
 
     tmp = [x.strip().lower() for x in from_file.split('\n') if x][1:]
     tmp = ['created_at {}'.format('.'.join(x.split())) if timestamp.match(x) else x for x in tmp]
@@ -86,229 +92,1207 @@ def extend_test_results(list_of_strings):
             elif re.match('created_at', key): 
                 tmpd['created_at'] = re.sub(r'\D', '.', entry)
 
-            # parse the device id and overall result
-            elif 'unit' in key: 
-                tmpd['overall'] = result.search(''.join(value.split())).group(0) if result.search(value)!=None else 'nan'
-                tmpd['id'] = model_no.search(''.join(value.split())).group(0) if model_no.search(value)!=None else 'nan'
-    
-    return tmpd
+            # parse the device id and overall result
+            elif 'unit' in key: 
+                tmpd['overall'] = result.search(''.join(value.split())).group(0) if result.search(value)!=None else 'nan'
+                tmpd['id'] = model_no.search(''.join(value.split())).group(0) if model_no.search(value)!=None else 'nan'
+    
+    return tmpd
+
+# sub-tests of a CLIO benchmark, in the order they show up in the files
+SUBTESTS = ['response', 'polarity', 'rub+buzz', 'thd']
+
+# a well-formed CLIO file is a header line, the four sub-test lines, the timestamp (date and time of day) and the unit line
+# (see parse_row_fast())
+CLIO_LINES = 7
+CLIO_SUBTEST_LINES = [{'{} {}'.format(feature, value): value for value in ('good', 'bad')} for feature in SUBTESTS]
+CLIO_TIMESTAMP = re.compile(r'(\d+\.){2}\d+\s+(\d+\.){2}\d+$')
+CLIO_UNIT = re.compile(r'unit n\. (\w\d{3}-\d{5}) (good|bad)$')
+
+def parse_row_fast(from_file):
+    '''
+    Single pass over the lines of a well-formed file, returns its row (see RESULT_COLUMNS) as
+    to_row(extend_test_results(parse_test_results(...))) would, or None if the file doesn't have the standard layout
+    '''
+    lines = [x.strip() for x in from_file.lower().split('\n') if x]
+    if len(lines) != CLIO_LINES:
+        return None
+
+    row = [valid.get(line) for valid, line in zip(CLIO_SUBTEST_LINES, lines[1:5])]
+    unit = CLIO_UNIT.match(lines[6])
+
+    if None in row or unit is None or not CLIO_TIMESTAMP.match(lines[5]):
+        return None
+
+    # same order as RESULT_COLUMNS
+    return row + ['.'.join(lines[5].split()), unit.group(2), unit.group(1)]
+
+def parse_clio_row(fname, path='Data/', from_file=None, outcomes=None):
+    '''
+    Row of a single CLIO file, well-formed files take the fast path and the others go through the repairs of parse_test_results().
+    Files that can't be read or parsed at all are rejected (None).
+    If given, outcomes (a Counter) counts the files 'parsed', 'repaired' and 'rejected'.
+    '''
+    try:
+        if from_file is None:
+            with open(os.path.join(path, fname), 'r') as f:
+                from_file = f.read()
+
+        row, outcome = parse_row_fast(from_file), 'parsed'
+        if row is None:
+            row, outcome = to_row(extend_test_results(parse_test_results(fname, path, from_file))), 'repaired'
+
+    except (IOError, UnicodeDecodeError, ValueError, AttributeError) as e:
+        print('PARSE_ERROR:', fname, e)
+        row, outcome = None, 'rejected'
+
+    if outcomes is not None:
+        outcomes[outcome] += 1
+
+    return row
+
+# timestamps are normalized to 'd.m.Y.H.M.S' before parsing
+TIMESTAMP_FORMAT = '%d.%m.%Y.%H.%M.%S'
+TIMESTAMP_FIELDS = re.compile(r'(\d+)\.(\d+)\.(\d+)\.(\d+)\.(\d+)\.(\d+)')
+
+def split_timestamp_series(series):
+    '''
+    Extracts the six zero-padded fields (day, month, year, hour, minute, second) of every entry in one pass.
+    Entries without a timestamp (or flagged as 'nan') get NaN in every field.
+    '''
+    as_str = series.astype(str)
+    fields = as_str.str.extract(TIMESTAMP_FIELDS, expand=True)
+    fields[as_str.str.contains('nan', regex=False)] = np.nan
+
+    return fields.apply(lambda x: x.str.zfill(2))
+
+def join_timestamp_fields(*fields):
+    '''
+    '''
+    # NaN in any field gives NaN
+    return fields[0].str.cat(list(fields[1:]), sep='.')
+
+def parse_own_timestamps(fields):
+    '''
+    Parses the fields of every entry (see split_timestamp_series()) into datetimes, swapping day and month back where the
+    alleged month is > 12 but the day is not. Entries that can't be parsed on their own are NaT (see parse_timestamp_series()).
+    '''
+    day, month, year, hour, minute, second = [fields[x] for x in fields.columns]
+
+    # bulk parse, anything that doesn't match the format becomes NaT
+    parsed = pd.to_datetime(join_timestamp_fields(day, month, year, hour, minute, second), format=TIMESTAMP_FORMAT, errors='coerce')
+    present = day.notnull()
+    failed = present & parsed.isnull()
+
+    if failed.any() or not present.all():
+        print('TIMESTAMP_PARSE_WARNING: {} entries do not match format \'{}\' and {} are missing'.format(failed.sum(), TIMESTAMP_FORMAT, (~present).sum()))
+        print('... attempting to fix the format:')
+
+    # day and month swapped
+    day_no = pd.to_numeric(day, errors='coerce')
+    month_no = pd.to_numeric(month, errors='coerce')
+    swapped = failed & (day_no <= 12) & (month_no > 12)
+    parsed[swapped] = pd.to_datetime(join_timestamp_fields(month, day, year, hour, minute, second)[swapped], format=TIMESTAMP_FORMAT, errors='coerce')
+
+    return parsed
+
+def parse_timestamp_series(series, fields=None, own=None):
+    '''
+    Parses the raw 'created_at' entries into datetimes, fixing the entries that do not match the standard format:
+        - day and month swapped (the alleged month is > 12 but the day is not), they are swapped back;
+        - neither day nor month is valid, the date is borrowed from the nearest neighbor and the time is kept;
+        - no timestamp at all (or one that can't be fixed), the whole timestamp is borrowed from the nearest neighbor.
+    The nearest neighbor is the next entry with a valid timestamp, or the previous one if there is none after it.
+    This method requires that the dataframe where the series comes from be sorted by ['id'].
+    fields and own (see split_timestamp_series() and parse_own_timestamps()) are computed if not given.
+    Every step is vectorized, so it runs in O(n) and always terminates.
+    '''
+    fields = split_timestamp_series(series) if fields is None else fields
+    parsed = parse_own_timestamps(fields) if own is None else own.copy()
+    day, month, year, hour, minute, second = [fields[x] for x in fields.columns]
+
+    # entries with a timestamp that could not be parsed on their own
+    present = day.notnull()
+    failed = present & parsed.isnull()
+
+    day_no = pd.to_numeric(day, errors='coerce')
+    month_no = pd.to_numeric(month, errors='coerce')
+
+    # nearest valid neighbor in the id-sorted order (the next one, or else the previous one)
+    neighbor = parsed.shift(-1).bfill().fillna(parsed.shift(1).ffill())
+
+    # neither can be a month: approximates the date from the neighbor and keeps the time
+    no_date = failed & (day_no > 12) & (month_no > 12) & neighbor.notnull()
+    parsed[no_date] = pd.to_datetime(join_timestamp_fields(neighbor[no_date].dt.strftime('%d.%m.%Y'), hour[no_date], minute[no_date], second[no_date]), format=TIMESTAMP_FORMAT, errors='coerce')
+
+    # everything still missing takes the whole timestamp of the neighbor
+    unresolved = parsed.isnull()
+    parsed[unresolved] = neighbor[unresolved]
+
+    if failed.any() or not present.all():
+        if parsed.isnull().any():
+            print('\tFAILED to handle timestamp format exception for {} entries (no neighbor with a valid timestamp)'.format(parsed.isnull().sum()))
+        else:
+            print('\tSUCCEEDED in handling exception for timestamp format.')
+
+    return parsed.rename(series.name)
+
+def repair_intervals(ids, own):
+    '''
+    Serials a new entry would change the repair of an entry that borrowed its timestamp with (see parse_timestamp_series()),
+    as [lo, hi] pairs (both included), for ids sorted like build_testresults_dataframe() sorts them and own their timestamps
+    parsed on their own (see parse_own_timestamps()). An entry with a valid timestamp landing in the run of entries that
+    borrowed from the same neighbor, or between them and that neighbor, changes what they borrow. '' stands for no lower bound
+    and None for no upper bound (entries without a serial sort last, ids only compare as strings).
+    '''
+    ids = np.asarray(ids, dtype=object)
+    valid = own.notnull().values
+    n = len(ids)
+
+    def key(i):
+        return ids[i] if isinstance(ids[i], str) else None
+
+    # runs of consecutive entries that borrow, from start (first of the run) to end (excluded)
+    broken = np.flatnonzero(~valid)
+    starts = broken[np.r_[True, np.diff(broken) > 1]] if len(broken) else broken
+    ends = broken[np.r_[np.diff(broken) > 1, True]] + 1 if len(broken) else broken
+
+    intervals = []
+    for start, end in zip(starts, ends):
+        # the run borrows from the entry after it, or from the one before it if it ends the frame
+        if end < n:
+            hi, lo = key(start), key(end)
+        elif start > 0:
+            hi, lo = key(start - 1), None
+        else:
+            return [['', None]]
+
+        # entries without a serial only come after every serial
+        if hi is not None:
+            intervals.append([lo or '', hi])
+
+    return intervals
+
+def parse_benchmark_state(df):
+    '''
+    Parses the number of failed tests for each Orion device in the dataframe
+    Returns a Series of states that can be used to create a new column in the dataframe
+    '''
+    # the overall results only take a handful of distinct values, so they are matched once per value
+    codes, uniques = pd.factorize(df.overall.astype(str))
+    uniques = pd.Series(uniques)
+
+    # number of failed sub-tests per device, counted column-wise
+    failed_n = (df.reindex(columns=SUBTESTS) == 'bad').sum(axis=1).values
+    failed_labels = np.array(['failed_{}'.format(x) for x in range(len(SUBTESTS) + 1)], dtype=object)
+
+    # labels are assigned from the lowest to the highest precedence ('good' wins over 'bad', which wins over 'nan')
+    states = np.full(len(df), np.nan, dtype=object)
+
+    nan = uniques.str.contains('nan', regex=False).values[codes]
+    states[nan] = 'nan'
+
+    bad = uniques.str.contains('bad', regex=False).values[codes]
+    states[bad] = failed_labels[failed_n[bad]]
+
+    states[uniques.str.contains('good', regex=False).values[codes]] = 'passed'
+    states = pd.Series(states, index=df.index)
+
+    if states.isnull().any():
+        print('BENCHMARK_STATE_PARSER_ERROR:', df[states.isnull()])
+
+    return states
+
+def build_testresults_dataframe(list_of_rows, repairs=None):
+    '''
+    Turns parsed rows (see RESULT_COLUMNS) into the final dataframe.
+    The timestamp repair looks at neighbors, so this always runs over the full set of rows. If repairs is a list,
+    the intervals of serials that new rows would change a repair with are added to it (see repair_intervals()).
+    '''
+    with timed_stage('frame', len(list_of_rows)):
+        # creates the dataframe
+        df = pd.DataFrame.from_records(list_of_rows, columns=RESULT_COLUMNS)
+
+        # sort by ['id'] to enable extra error handling in parse_timestamp_series()
+        df.sort_values(by=['id'], inplace=True, ascending=False, kind='mergesort')
+        df.reset_index(inplace=True, drop=True)
+
+    with timed_stage('timestamps', len(df)):
+        # standardizes the timestamp format in 'created_at' and transforms to datetime
+        fields = split_timestamp_series(df.created_at)
+        own = parse_own_timestamps(fields)
+
+        if repairs is not None:
+            repairs.extend(repair_intervals(df.id.values, own))
+
+        df.created_at = parse_timestamp_series(df.created_at, fields, own)
+
+    with timed_stage('cleanup', len(df)):
+        # finds and drop rows that have no valid field
+        df.replace(to_replace='nan', value=np.nan, inplace=True)
+        df.dropna(how='all', inplace=True)
+    
+    with timed_stage('state', len(df)):
+        # extends the dataframe to have columns states (the number of failed tests if any, or passed if none)
+        df['state'] = parse_benchmark_state(df)
+
+    return df
+
+def load_testresults_todataframe(path, is_csv=False, manifest_path=None, n_jobs=1, progress=None, fingerprint=None, manifest=None):
+    '''
+    FUTURE feature:
+        handle single files (txt, csv and json)
+
+    If manifest_path is given, parsed rows are cached there and only new or changed files are parsed again. The manifest also
+    keeps the intervals of serials new rows would change a timestamp repair with (see load_new_testresults()) and fingerprint,
+    the state of path (see directory_fingerprint()) the frame is being loaded for. manifest is the one at manifest_path if
+    it was loaded already (e.g. without its rows, and updated with the new files, by load_new_testresults()).
+    With n_jobs > 1 the files are parsed in a pool of n_jobs processes.
+    progress is called with the running count of files parsed, repaired and rejected (see parse_files())
+    '''
+    # parses the text files into a list of rows that will be used to create the dataframe
+    with timed_stage('parse') as stage:
+        if manifest_path:
+            # the files manifest was updated with are not parsed again
+            if manifest is None:
+                manifest = load_manifest(manifest_path)
+            else:
+                load_manifest_rows(manifest, manifest_path)
+
+            list_of_rows = parse_testresults_cached(path, manifest, n_jobs, progress)
+
+        else:
+            list_of_rows = [row for rows in parse_files(path, sorted(os.listdir(path)), n_jobs, progress=progress) for row in rows]
+
+        stage['rows'] = len(list_of_rows)
+
+    if not manifest_path:
+        return build_testresults_dataframe(list_of_rows)
+
+    repairs = []
+    df = build_testresults_dataframe(list_of_rows, repairs)
+
+    manifest.update(repairs=repairs, fingerprint=fingerprint)
+    save_manifest(manifest, manifest_path)
+
+    return df
+
+def load_new_testresults(path, manifest, fingerprint, n_jobs=1, progress=None):
+    '''
+    Returns the dataframe of the rows of the files added to path since it was at fingerprint (see directory_fingerprint()),
+    as load_testresults_todataframe() would build them along with every other file, and what was added to the manifest
+    for them: {'files': names of the new files, 'repairs': intervals of their repairs} (see append_manifest()).
+    The frame is None when that can't be told from the new files alone: the manifest was not saved at fingerprint, files
+    were changed or removed, a new row has no serial, borrows its timestamp from a row that is not new or may have an older
+    row sort between it and the one it borrows from, or its serial falls in an interval where it would change how an older
+    row was repaired (see repair_intervals()). The whole directory is loaded then.
+    The manifest (loaded without its rows, see load_manifest()) is updated in place with the new files, it is up to the
+    caller to save it, or to pass it on to load_testresults_todataframe().
+    '''
+    if fingerprint is None or manifest.get('fingerprint') != fingerprint or manifest.get('repairs') is None or manifest.get('ids') is None:
+        return None, None
+
+    names, only_added = update_manifest(path, manifest, n_jobs, progress)
+    if not only_added:
+        return None, None
+
+    id_column = RESULT_COLUMNS.index('id')
+    list_of_rows = manifest_rows(manifest, names)
+    ids = [row[id_column] for row in list_of_rows]
+    if not all(isinstance(x, str) for x in ids):
+        return None, None
+
+    repairs = []
+    df = build_testresults_dataframe(list_of_rows, repairs)
+
+    # new rows that borrowed from another new row, with no older row in between (found by binary search over the serials)
+    if any(lo == '' or hi is None for lo, hi in repairs):
+        return None, None
+
+    old_ids = manifest['ids']
+    if any(np.searchsorted(old_ids, hi, side='right') > np.searchsorted(old_ids, lo, side='left') for lo, hi in repairs):
+        return None, None
+
+    for lo, hi in manifest['repairs']:
+        if any(lo <= x and (hi is None or x <= hi) for x in ids):
+            return None, None
+
+    manifest['repairs'].extend(repairs)
+
+    return df, dict(files=names, repairs=repairs)
+
+def parse_file_batch(path, fnames):
+    '''
+    Parses a batch of files into rows (see RESULT_COLUMNS), this is the unit of work of the process pool
+    Returns one list of rows per file (archives hold many results, rejected files none) and the count of files
+    parsed, repaired and rejected
+    '''
+    outcomes = Counter()
+    list_of_rows = []
+    for txt_file in fnames:
+        if is_archive(txt_file):
+            list_of_rows.append(parse_archive(txt_file, path, outcomes))
+
+        else:
+            row = parse_clio_row(txt_file, path, outcomes=outcomes)
+            list_of_rows.append([] if row is None else [row])
+
+    return list_of_rows, outcomes
+
+# without a process pool, files are still parsed in batches of this size so progress can be reported
+PROGRESS_BATCH_SIZE = 512
+
+def parse_files(path, fnames, n_jobs=1, batches_per_job=4, progress=None):
+    '''
+    Parses the files into lists of rows (one per file), in the order of fnames.
+    With n_jobs > 1, fnames is split into contiguous batches that are parsed in a process pool and concatenated in order,
+    so the result is the same as parsing them one by one.
+    After every batch, progress (if given) is called with the running count of files parsed, repaired and rejected.
+    '''
+    if n_jobs <= 1 or len(fnames) < 2:
+        batch_size = PROGRESS_BATCH_SIZE if progress else max(1, len(fnames))
+    else:
+        batch_size = max(1, -(-len(fnames) // (n_jobs * batches_per_job)))
+
+    batches = [fnames[i:i + batch_size] for i in range(0, len(fnames), batch_size)]
+
+    list_of_rows = []
+    outcomes = Counter()
+
+    def collect(results):
+        # results come in submission order, whatever order they finish in
+        for rows, counts in results:
+            list_of_rows.extend(rows)
+            outcomes.update(counts)
+
+            if progress:
+                progress(dict(outcomes))
+
+    if n_jobs <= 1 or len(fnames) < 2:
+        collect(parse_file_batch(path, batch) for batch in batches)
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            collect(executor.map(parse_file_batch, [path]*len(batches), batches))
+
+    return list_of_rows
+
+
+# ---------------------- AUX METHODS FOR ARCHIVES -------------------------- #
+
+# a day of results can be dropped as a single archive, its members are parsed without being extracted
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_archive(fname):
+    '''
+    '''
+    return fname.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_archive_members(fpath, on_error=None):
+    '''
+    Yields (name, content) for every regular file in a zip or tar archive, reading one member at a time.
+    Members are decoded like open(fname, 'r') would (locale encoding, universal newlines). Members that can't be decoded
+    (e.g. a pdf next to the results) are skipped, on_error(name, error) is called for each of them if given.
+    '''
+    def is_result(name):
+        return not (os.path.basename(name).startswith('.') or '__MACOSX' in name)
+
+    def decode(name, member):
+        try:
+            return io.TextIOWrapper(member).read()
+
+        except (UnicodeDecodeError, ValueError) as e:
+            if on_error is not None:
+                on_error(name, e)
+            return None
+
+    if fpath.lower().endswith('.zip'):
+        with zipfile.ZipFile(fpath) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_result(info.filename):
+                    with archive.open(info) as member:
+                        content = decode(info.filename, member)
+
+                    if content is not None:
+                        yield info.filename, content
+
+    else:
+        with tarfile.open(fpath, 'r:*') as archive:
+            for info in archive:
+                if info.isfile() and is_result(info.name):
+                    content = decode(info.name, archive.extractfile(info))
+
+                    if content is not None:
+                        yield info.name, content
+
+def parse_archive(fname, path='Data/', outcomes=None):
+    '''
+    Parses every member of the archive path/fname into rows (see RESULT_COLUMNS), outcomes as in parse_clio_row().
+    Members that can't be decoded are rejected like loose files, the rest of the archive is still parsed.
+    '''
+    def reject(name, e):
+        print('PARSE_ERROR:', name, e)
+        if outcomes is not None:
+            outcomes['rejected'] += 1
+
+    list_of_rows = []
+    try:
+        for name, from_file in iter_archive_members(os.path.join(path, fname), on_error=reject):
+            row = parse_clio_row(os.path.basename(name), path, from_file, outcomes)
+            if row is not None:
+                list_of_rows.append(row)
+
+    except (zipfile.BadZipfile, tarfile.TarError, IOError) as e:
+        print('ARCHIVE_PARSE_ERROR:', fname, e)
+        if outcomes is not None:
+            outcomes['rejected'] += 1
+
+    return list_of_rows
+
+
+# ---------------------- AUX METHODS FOR INGESTION CACHE -------------------------- #
+
+# order of the columns in a parsed row (same order extend_test_results fills them in)
+RESULT_COLUMNS = ['response', 'polarity', 'rub+buzz', 'thd', 'created_at', 'overall', 'id']
+
+# the manifest is saved whole (see append_manifest()) once the entries appended to its log take this many bytes
+MANIFEST_LOG_SIZE = 1 << 24
+
+def to_row(test_results):
+    '''
+    Flattens the dict returned by extend_test_results() into a list ordered as RESULT_COLUMNS
+    '''
+    return [test_results.get(column, np.nan) for column in RESULT_COLUMNS]
+
+def hash_file(fpath):
+    '''
+    '''
+    sha1 = hashlib.sha1()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+def load_manifest(fpath, rows=True):
+    '''
+    Reads the ingestion manifest: {'files': {fname: {'size', 'mtime', 'sha1', 'rows'}}, 'repairs', 'fingerprint', 'ids'},
+    with the entries appended since it was last saved applied (see append_manifest()). ids are the sorted serials of every
+    row (None if unknown). The parsed rows are kept in a file of their own, only read with rows (see load_manifest_rows()),
+    so an ingestion of new files doesn't read the rows of the whole history.
+    '''
+    try:
+        with open(fpath, 'r') as f:
+            manifest = json.load(f)
+
+    except (IOError, ValueError) as e:
+        if os.path.exists(fpath):
+            print('MANIFEST_LOAD_WARNING:', e)
+
+        # entries appended to a manifest that can't be read would pass for all of it
+        return dict(files={}, ids=None)
+
+    manifest.setdefault('files', {})
+
+    try:
+        ids = np.load(fpath + '.ids.npy')
+    except (IOError, ValueError):
+        ids = None
+
+    added_ids = []
+    try:
+        with open(fpath + '.log', 'r') as f:
+            for line in f:
+                # a line cut short by a crash, and whatever follows it, never made it
+                try:
+                    entries = json.loads(line)
+                except ValueError:
+                    break
+
+                manifest['files'].update(entries.pop('files'))
+                manifest.setdefault('repairs', []).extend(entries.pop('repairs'))
+                added_ids.extend(entries.pop('ids'))
+                manifest.update(entries)
+
+    except IOError:
+        pass
+
+    if ids is not None and added_ids:
+        ids = np.unique(np.concatenate([ids, np.array(added_ids, dtype=str)]))
+    manifest['ids'] = ids
+
+    if rows:
+        load_manifest_rows(manifest, fpath)
+
+    return manifest
+
+def load_manifest_rows(manifest, fpath):
+    '''
+    Fills in the parsed rows of the files of the manifest that have none from the rows file (one json [fname, rows] per
+    line, the last line of a file wins). Files it has no rows for are dropped from the manifest, so they are parsed again.
+    '''
+    files = manifest['files']
+    missing = set(name for name, entry in files.items() if 'rows' not in entry)
+    if not missing:
+        return
+
+    try:
+        with open(fpath + '.rows', 'r') as f:
+            for line in f:
+                # lines cut short by a crash are skipped, their files are parsed again
+                try:
+                    name, rows = json.loads(line)
+                except ValueError:
+                    continue
+
+                if name in missing:
+                    files[name]['rows'] = rows
+
+    except IOError:
+        pass
+
+    for name in missing:
+        if 'rows' not in files[name]:
+            del files[name]
+
+def manifest_ids(manifest, names=None):
+    '''
+    Sorted serials of the rows of the files in names (all of them by default)
+    '''
+    id_column = RESULT_COLUMNS.index('id')
+    names = manifest['files'] if names is None else names
+
+    return np.unique(np.array([row[id_column] for name in names for row in manifest['files'][name]['rows']
+                               if isinstance(row[id_column], str)], dtype=str))
+
+def save_manifest(manifest, fpath):
+    '''
+    Writes the manifest (its rows and serials in files of their own) atomically, so a crash never leaves a half-written
+    cache behind. The manifest itself is written last, the rows and serials of the files it lists are in place by then.
+    '''
+    dirname = os.path.dirname(fpath)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    with open(fpath + '.rows.tmp', 'w') as f:
+        for name, entry in manifest['files'].items():
+            f.write(json.dumps([name, entry['rows']]) + '\n')
+    os.replace(fpath + '.rows.tmp', fpath + '.rows')
+
+    manifest['ids'] = manifest_ids(manifest)
+    with open(fpath + '.ids.tmp', 'wb') as f:
+        np.save(f, manifest['ids'])
+    os.replace(fpath + '.ids.tmp', fpath + '.ids.npy')
+
+    index = {key: value for key, value in manifest.items() if key not in ('files', 'ids')}
+    index['files'] = {name: {key: value for key, value in entry.items() if key != 'rows'} for name, entry in manifest['files'].items()}
+
+    tmp_path = '{}.tmp'.format(fpath)
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+
+    os.replace(tmp_path, fpath)
+
+    # the entries appended since are in the manifest now
+    if os.path.exists(fpath + '.log'):
+        os.remove(fpath + '.log')
+
+def append_manifest(manifest, added, fpath):
+    '''
+    Appends what was added to the manifest, {'files': names of the files added, 'repairs': intervals added (see
+    load_new_testresults())}, and its fingerprint to the log of the manifest, and the rows of the files added to its rows
+    file, so an ingestion only writes its own files. The manifest is saved whole once the log takes MANIFEST_LOG_SIZE bytes.
+    '''
+    log_path = fpath + '.log'
+    if not os.path.exists(fpath) or (os.path.exists(log_path) and os.path.getsize(log_path) > MANIFEST_LOG_SIZE):
+        load_manifest_rows(manifest, fpath)
+        return save_manifest(manifest, fpath)
+
+    # the rows first, the log entry is what makes the files part of the manifest
+    with open(fpath + '.rows', 'a') as f:
+        for name in added['files']:
+            f.write(json.dumps([name, manifest['files'][name]['rows']]) + '\n')
+
+    entries = dict(fingerprint=manifest.get('fingerprint'), repairs=added['repairs'], ids=manifest_ids(manifest, added['files']).tolist(),
+                   files={name: {key: value for key, value in manifest['files'][name].items() if key != 'rows'} for name in added['files']})
+
+    with open(log_path, 'a') as f:
+        f.write(json.dumps(entries) + '\n')
+
+def update_manifest(path, manifest, n_jobs=1, progress=None):
+    '''
+    Parses the files in path the manifest has no valid entry for, an entry is valid if size and mtime are unchanged,
+    or if the content hash is unchanged. The manifest is updated in place (entries of deleted files are dropped).
+    Returns the names of the files parsed, and whether they are all new files (no file was changed or removed).
+    '''
+    cached = manifest['files']
+    entries = OrderedDict()
+    to_parse = []
+    only_added = True
+
+    for dir_entry in sorted(os.scandir(path), key=lambda x: x.name):
+        txt_file = dir_entry.name
+
+        # subdirectories (and anything else that isn't a regular file) hold no results
+        if not dir_entry.is_file():
+            continue
+
+        stat = dir_entry.stat()
+        entry = cached.get(txt_file)
+
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            sha1 = hash_file(dir_entry.path)
+
+            if entry is None or entry['sha1'] != sha1:
+                only_added = only_added and entry is None
+                entry = dict(sha1=sha1, rows=None)
+                to_parse.append(txt_file)
+
+            entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+
+        entries[txt_file] = entry
+
+    # only the new or changed files are parsed
+    with timed_stage('parse_new_files', len(to_parse)):
+        for txt_file, rows in zip(to_parse, parse_files(path, to_parse, n_jobs, progress=progress)):
+            entries[txt_file]['rows'] = rows
+
+    only_added = only_added and len(entries) - len(to_parse) == len(cached)
+    manifest['files'] = dict(entries)
+
+    return to_parse, only_added
+
+def manifest_rows(manifest, names=None):
+    '''
+    Parsed rows of the files in names (all of them by default), in the order of the manifest
+    '''
+    names = manifest['files'] if names is None else names
+
+    list_of_rows = []
+    for name in names:
+        # json stores missing values as null
+        list_of_rows.extend([[np.nan if x is None else x for x in row] for row in manifest['files'][name]['rows']])
+
+    return list_of_rows
+
+def parse_testresults_cached(path, manifest, n_jobs=1, progress=None):
+    '''
+    Returns the parsed rows for every file in path, parsing only the files the manifest has no valid entry for (see update_manifest())
+    '''
+    update_manifest(path, manifest, n_jobs, progress)
+
+    return manifest_rows(manifest)
+
+
+# ---------------------- AUX METHODS FOR COLUMNAR SNAPSHOT -------------------------- #
+# A snapshot keeps the output of load_testresults_todataframe() on disk as plain NumPy arrays, partitioned by model series
+# (the serial prefix, e.g. F072) and test day, one .npy file per column:
+#     snapshot_dir/snapshot.json                         (partition manifest, see below)
+#     snapshot_dir/<series>/<day>/<segment>/<i>.npy      (column i of a segment of the partition)
+#     snapshot_dir/<series>/<day>/<segment>/columns.json (names and kinds of the columns of the segment)
+#     snapshot_dir/consolidated/<segment>/...            (the same rows, across partitions, see below)
+#     snapshot_dir/consolidated/<segment>/times.npy      (their sorted 'created_at', and by_time.npy their positions)
+# Text columns are dictionary encoded (int32 codes, the categories are kept in <i>.categories.*) and 'created_at' is stored
+# as datetime64[ns], so every file can be memory-mapped. New rows are appended as new segments of their partitions.
+# For each partition the manifest keeps its segments and its number of rows, devices per state and failed sub-tests,
+# so a date range only reads the partitions it overlaps and the daily counts are known without reading any rows.
+# Every row is also appended to the consolidated segments, a log of a few segments holding all partitions that a load of
+# the whole snapshot reads instead of the files of every partition (see merge_consolidated_segments()). A date range is
+# read from them too: each keeps its rows in time order, so the range is found by binary search and only its rows are read.
+# Columns are loaded back dictionary encoded, as categoricals, the rows are never decoded to Python strings.
+
+# partitions with more segments than this are merged back into one when rows are appended
+MAX_PARTITION_SEGMENTS = 8
+
+# directory of the consolidated segments (partition series are upper case)
+CONSOLIDATED = 'consolidated'
+
+# version of the layout above, snapshots written with an older one are rebuilt
+SNAPSHOT_FORMAT = 2
+
+def directory_fingerprint(path):
+    '''
+    Hash of the names, sizes and mtimes of the files in path, used to tell if a snapshot is still up to date
+    '''
+    sha1 = hashlib.sha1()
+    for entry in sorted(os.scandir(path), key=lambda x: x.name):
+        stat = entry.stat()
+        sha1.update('{}:{}:{}\n'.format(entry.name, stat.st_size, stat.st_mtime_ns).encode('utf8'))
+
+    return sha1.hexdigest()
+
+def load_snapshot_meta(snapshot_dir):
+    '''
+    Returns None if there is no snapshot (or one written with an older layout, see SNAPSHOT_FORMAT, which is then rebuilt)
+    '''
+    try:
+        with open(os.path.join(snapshot_dir, 'snapshot.json'), 'r') as f:
+            meta = json.load(f)
+
+    except (IOError, ValueError):
+        return None
+
+    return meta if meta.get('format') == SNAPSHOT_FORMAT else None
+
+def save_snapshot_meta(meta, snapshot_dir):
+    '''
+    '''
+    tmp_path = os.path.join(snapshot_dir, 'snapshot.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+
+    os.replace(tmp_path, os.path.join(snapshot_dir, 'snapshot.json'))
+
+def write_snapshot_segment(df, segment_dir):
+    '''
+    Writes every column of df as a .npy file, and their description in columns.json. The categories of a dictionary encoded
+    column are written apart, as json (read whole) and as an array of fixed-width strings (read by position).
+    '''
+    # leftovers of a segment a crash kept out of the manifest are overwritten
+    os.makedirs(segment_dir, exist_ok=True)
+
+    columns = []
+    for i, column in enumerate(df.columns):
+        fpath = os.path.join(segment_dir, '{}.npy'.format(i))
+
+        if pd.api.types.is_datetime64_any_dtype(df[column].dtype):
+            np.save(fpath, df[column].values.astype('datetime64[ns]'))
+            columns.append(dict(name=column, kind='datetime64'))
+
+        elif pd.api.types.is_categorical_dtype(df[column].dtype):
+            # categoricals keep their own codes and order, so they are mapped back without a copy
+            np.save(fpath, df[column].cat.codes.values)
+            write_segment_categories(segment_dir, i, df[column].cat.categories.tolist())
+            columns.append(dict(name=column, kind='category', ordered=bool(df[column].cat.ordered)))
+
+        elif pd.api.types.is_integer_dtype(df[column].dtype):
+            np.save(fpath, df[column].values)
+            columns.append(dict(name=column, kind='array'))
+
+        else:
+            # missing values get the code -1
+            codes, categories = pd.factorize(df[column])
+            np.save(fpath, codes.astype(np.int32))
+            write_segment_categories(segment_dir, i, list(categories))
+            columns.append(dict(name=column, kind='category'))
+
+    with open(os.path.join(segment_dir, 'columns.json'), 'w') as f:
+        json.dump(columns, f)
+
+def write_segment_categories(segment_dir, i, categories):
+    '''
+    '''
+    with open(os.path.join(segment_dir, '{}.categories.json'.format(i)), 'w') as f:
+        json.dump(categories, f)
+
+    np.save(os.path.join(segment_dir, '{}.categories.npy'.format(i)), np.array(categories, dtype=str))
+
+def read_snapshot_segment(segment_dir, mmap=True, positions=None):
+    '''
+    Columns of a segment written by write_snapshot_segment(), only the rows at positions if given
+    '''
+    with open(os.path.join(segment_dir, 'columns.json'), 'r') as f:
+        columns = json.load(f)
+
+    data = OrderedDict()
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(segment_dir, '{}.npy'.format(i)), mmap_mode='r' if mmap else None)
+        if positions is not None:
+            values = values[positions]
+
+        if column['kind'] == 'category' and positions is None:
+            with open(os.path.join(segment_dir, '{}.categories.json'.format(i)), 'r') as f:
+                values = pd.Categorical.from_codes(values, json.load(f), ordered=column.get('ordered', False))
+
+        elif column['kind'] == 'category':
+            # only the categories of the rows read, picked from the array of all of them (missing values keep the code -1)
+            used, codes = np.unique(values, return_inverse=True)
+            missing = bool(len(used)) and used[0] < 0
+            categories = np.load(os.path.join(segment_dir, '{}.categories.npy'.format(i)), mmap_mode='r')[used[1:] if missing else used]
+            values = pd.Categorical.from_codes(codes - 1 if missing else codes, categories.astype(object), ordered=column.get('ordered', False))
+
+        data[column['name']] = values
+
+    return data
+
+def partition_keys(df):
+    '''
+    Model series (serial prefix, upper case) and test day ('YYYY-MM-DD') of every row, 'unknown' when missing
+    '''
+    series = df.id.astype(object).str.split('-', n=1).str[0].str.upper().fillna('unknown').values
+
+    created_at = pd.to_datetime(df.created_at)
+    days = np.where(created_at.isnull(), 'unknown', created_at.dt.strftime('%Y-%m-%d')).astype(object)
+
+    return series, days
+
+def partition_counts(df):
+    '''
+    Devices per state and failed sub-tests of the rows of a partition, as stored in the manifest
+    '''
+    states = df.state.astype(object).value_counts() if 'state' in df.columns else pd.Series()
+    failed = (df.reindex(columns=SUBTESTS) == 'bad').sum()
+
+    return {str(k): int(v) for k, v in states.items()}, {k: int(v) for k, v in failed.items()}
+
+def save_snapshot(df, snapshot_dir, fingerprint=None):
+    '''
+    Replaces the snapshot in snapshot_dir with the rows of df (one segment per partition)
+    '''
+    old_meta = load_snapshot_meta(snapshot_dir)
+
+    # leftovers of a snapshot without a (readable) manifest can't be reused
+    if old_meta is None and os.path.exists(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+
+    if not os.path.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    meta = dict(partitions={}, rows=0, fingerprint=fingerprint, next_segment=old_meta['next_segment'] if old_meta else 0, format=SNAPSHOT_FORMAT)
+    meta[CONSOLIDATED] = []
+    meta = add_snapshot_segment(df, snapshot_dir, meta)
+
+    # segments of the replaced snapshot are only removed once the new one is in place
+    if old_meta:
+        for key, partition in old_meta['partitions'].items():
+            for segment in partition['segments']:
+                shutil.rmtree(os.path.join(snapshot_dir, key, segment['name']), ignore_errors=True)
+
+        for segment in old_meta[CONSOLIDATED]:
+            shutil.rmtree(os.path.join(snapshot_dir, CONSOLIDATED, segment['name']), ignore_errors=True)
+
+    return meta
+
+def append_snapshot(df, snapshot_dir, fingerprint=None):
+    '''
+    Appends the rows in df to the snapshot as new segments of their partitions (the other partitions are not read)
+    '''
+    meta = load_snapshot_meta(snapshot_dir)
+    if meta is None:
+        return save_snapshot(df, snapshot_dir, fingerprint)
+
+    meta['fingerprint'] = fingerprint
+    return add_snapshot_segment(df, snapshot_dir, meta)
+
+def add_snapshot_segment(df, snapshot_dir, meta):
+    '''
+    Writes the rows of df as a new segment of each partition they fall in and of the consolidated segments, and updates the manifest
+    '''
+    series, days = partition_keys(df)
+    groups = pd.DataFrame(dict(series=series, day=days)).groupby(['series', 'day'], sort=True).indices
+    merged = []
+
+    for (series, day), positions in groups.items():
+        key = '{}/{}'.format(series, day)
+        rows = df.iloc[positions]
+        states, failed = partition_counts(rows)
+
+        partition = meta['partitions'].setdefault(key, dict(series=series, day=day, rows=0, states={}, failed={}, segments=[]))
+        partition['rows'] += len(rows)
+        partition['states'] = {k: partition['states'].get(k, 0) + states.get(k, 0) for k in set(partition['states']) | set(states)}
+        partition['failed'] = {k: partition['failed'].get(k, 0) + failed.get(k, 0) for k in set(partition['failed']) | set(failed)}
+
+        name = new_segment_name(meta)
+        write_snapshot_segment(rows, os.path.join(snapshot_dir, key, name))
+        partition['segments'].append(dict(name=name, rows=len(rows)))
+
+        if len(partition['segments']) > MAX_PARTITION_SEGMENTS:
+            merged.extend(merge_partition_segments(snapshot_dir, key, partition, meta))
+
+    if len(df):
+        name = new_segment_name(meta)
+        write_consolidated_segment(df, os.path.join(snapshot_dir, CONSOLIDATED, name))
+        meta[CONSOLIDATED].append(dict(name=name, rows=len(df)))
+
+    meta['rows'] += len(df)
+    save_snapshot_meta(meta, snapshot_dir)
+
+    # the merged segments are only removed once the manifest points to the new ones
+    for segment_dir in merged:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+    merge_consolidated_segments(snapshot_dir, meta)
+
+    return meta
+
+def new_segment_name(meta):
+    '''
+    '''
+    name = '{:05d}'.format(meta['next_segment'])
+    meta['next_segment'] += 1
+
+    return name
+
+def merge_partition_segments(snapshot_dir, key, partition, meta):
+    '''
+    Rewrites the segments of a partition as a single one. The manifest is saved by the caller, who then removes the
+    directories of the old segments this returns.
+    '''
+    rows = sort_by_id(read_partition(snapshot_dir, key, partition, mmap=False))
+
+    name = new_segment_name(meta)
+    write_snapshot_segment(rows, os.path.join(snapshot_dir, key, name))
+
+    old_segments, partition['segments'] = partition['segments'], [dict(name=name, rows=len(rows))]
+
+    return [os.path.join(snapshot_dir, key, segment['name']) for segment in old_segments]
+
+def merge_consolidated_segments(snapshot_dir, meta):
+    '''
+    Merges the last two consolidated segments for as long as the one before the last holds at most twice as many rows as
+    the last, so their sizes at least double from the last to the first: a row is rewritten O(log n) times and a full load
+    reads O(log n) segments. Merged rows are kept in the order of a full load (see sort_by_id()).
+    '''
+    segments = meta[CONSOLIDATED]
+
+    while len(segments) > 1 and segments[-2]['rows'] <= 2 * segments[-1]['rows']:
+        merged = segments[-2:]
+        rows = sort_by_id(concat_frames([read_segment(snapshot_dir, CONSOLIDATED, x, mmap=False) for x in merged], ignore_index=True))
+
+        name = new_segment_name(meta)
+        write_consolidated_segment(rows, os.path.join(snapshot_dir, CONSOLIDATED, name))
+
+        # the old segments are only removed once the manifest points to the new one
+        segments[-2:] = [dict(name=name, rows=len(rows))]
+        save_snapshot_meta(meta, snapshot_dir)
+
+        for segment in merged:
+            shutil.rmtree(os.path.join(snapshot_dir, CONSOLIDATED, segment['name']), ignore_errors=True)
+
+def write_consolidated_segment(df, segment_dir):
+    '''
+    Writes df as a segment (see write_snapshot_segment()) with the positions of its rows in time order (by_time.npy),
+    rows without a timestamp last, and their sorted timestamps (times.npy)
+    '''
+    write_snapshot_segment(df, segment_dir)
+
+    times = pd.to_datetime(df['created_at']).values.astype('datetime64[ns]')
+    by_time = np.argsort(times, kind='mergesort')
+    np.save(os.path.join(segment_dir, 'by_time.npy'), by_time)
+    np.save(os.path.join(segment_dir, 'times.npy'), times[by_time])
 
-def clean_timestamp_series(series):
+def read_segment(snapshot_dir, key, segment, mmap=True):
     '''
     '''
-    return series.apply(lambda x: np.nan if ('nan' in str(x)) else re.search(r'(\d+\.){5}\d+', str(x)).group(0))
+    return pd.DataFrame(read_snapshot_segment(os.path.join(snapshot_dir, key, segment['name']), mmap))
 
-def pad_timestamp_series(series):
+def read_consolidated_window(snapshot_dir, segment, start=None, end=None, mmap=True):
     '''
+    Rows of a consolidated segment tested from start to end (both included, days), in the order of the segment.
+    The range is found by binary search over the sorted timestamps, only its rows are read.
     '''
-    return series.apply(lambda x: np.nan if ('nan' in str(x)) else '.'.join([y.zfill(2) for y in str(x).split('.')]))
+    segment_dir = os.path.join(snapshot_dir, CONSOLIDATED, segment['name'])
+    times = np.load(os.path.join(segment_dir, 'times.npy'), mmap_mode='r')
+
+    # rows without a timestamp sort last and are left out
+    i = 0 if start is None else np.searchsorted(times, pd.Timestamp(start).normalize().to_datetime64(), side='left')
+    j = np.searchsorted(times, np.datetime64('NaT') if end is None else (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_datetime64(), side='left')
+
+    by_time = np.load(os.path.join(segment_dir, 'by_time.npy'), mmap_mode='r')
+    positions = np.sort(by_time[i:max(i, j)])
 
-def parse_timestamp_series(series):
+    return pd.DataFrame(read_snapshot_segment(segment_dir, mmap, positions))
+
+def read_partition(snapshot_dir, key, partition, mmap=True):
     '''
-    Finds entries in the given Series that do not match the standard format and attempts to fix them
-    This method requires that the dataframe where the series comes from be sorted by ['id'].
     '''
-    tmp = []
+    return concat_frames([read_segment(snapshot_dir, key, segment, mmap) for segment in partition['segments']], ignore_index=True)
 
-    def find_nearest_neighbor(index, series):
-        # finds the nearest neighbor with a valid date                    
-        neighbor_index = np.nan
-        i = index + 1
-        j = index - 1
+def snapshot_partitions(meta, start=None, end=None, series=None):
+    '''
+    Keys of the partitions tested from start to end (both included, days) of the given model series, in key order.
+    Rows without a test day are only part of unbounded queries.
+    '''
+    start = None if start is None else pd.Timestamp(start).strftime('%Y-%m-%d')
+    end = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+    series = None if series is None else set(x.upper() for x in series)
 
-        while(True):
-            if (i < len(series)-1) and (i + (1 if pd.isnull(series[i]) else 0) == i):
-                return i
-            elif i < len(series)-1:
-                i += 1
-            
-            elif (j - (1 if pd.isnull(series[j]) else 0) == j):
-                return j
-            elif j > 1:
-                j -= 1
-            
-        return np.nan
+    keys = []
+    for key, partition in sorted(meta['partitions'].items()):
+        day = partition['day']
 
-    for index, value in series.iteritems():
-        NaN_FLAG = pd.isnull(value)
+        if (start is not None or end is not None) and day == 'unknown':
+            continue
+        if (start is not None and day < start) or (end is not None and day > end):
+            continue
+        if series is not None and partition['series'] not in series:
+            continue
 
-        if not NaN_FLAG:
-            try:
-                tmp.append(pd.to_datetime(value, format='%d.%m.%Y.%H.%M.%S', errors='raise'))
-            
-            except ValueError as e:
-                print('TIMESTAMP_PARSE_WARNING:', e)
-                print('... attempting to fix the format:')
-        
-                date_pattern = re.compile(r'(\d+\.){5}\d+')
-                date_to_fix = date_pattern.search(str(e)).group(0)
-                
-                # grabs the alleged day and month
-                first, second, tail = date_to_fix.split('.',2) 
-                
-                if ((int(first) <= 12) and (int(second) > 12)):
-                    try:
-                        tmp.append(pd.to_datetime('{}.{}.{}'.format(second, first, tail), format='%d.%m.%Y.%H.%M.%S'))
-                    
-                    except Exception as ex:
-                        print('\tFAILED to handle timestamp format exception: ', ex)
-                    
-                    else:
-                        print('\tSUCCEEDED in handling exception for timestamp format.')
-                        pass
-        
-                elif ((int(first) > 12) and (int(second) > 12)):
-
-                    try:
-                        # find the nearest neighbor with a valid date            
-                        neighbor_index = find_nearest_neighbor(index, series)
-                        
-                        if pd.isnull(neighbor_index):
-                            raise IndexError('Could not find neighbor with valid timestamp')
-                    
-                    except IndexError as ex:
-                        print(e, series[index])
-                        pass
-                    
-                    else:
-                        new_date = '{}.{}'.format(str(series[neighbor_index]).rsplit('.',3)[0], value.split('.', 3)[-1])
-                
-                    try: # to approxiamte the date from a neighbor, the original dataframe must be sorted by ['id'], though.
-                        tmp.append(pd.to_datetime(new_date, format='%d.%m.%Y.%H.%M.%S'))
-                    
-                    except Exception as ex:
-                        print('\tFAILED to handle timestamp format exception: ', ex)
-                    
-                    else:
-                        print('\tSUCCEEDED in handling exception for timestamp format.')
-                        pass
-        
-        else:
-            print('TIMESTAMP_PARSE_WARNING: time data \'{}\' does not match format \'%d.%m.%Y.%H.%M.%S\' (index: {})'.format(value, index))
-            print('... attempting to fix the format:')
+        keys.append(key)
 
-            # find the next neighbor with a valid timestamp to approximate
-            try:
-                neighbor_index = find_nearest_neighbor(index, series)
-                
-                if pd.isnull(neighbor_index):
-                    raise IndexError('Could not find neighbor with valid timestamp')
-            
-            except IndexError as ex:
-                print(e, series[index])
-                pass
-            
-            else:
-                new_date = str(series[neighbor_index])
-        
-            try: # to approxiamte the date from a neighbor, the original dataframe must be sorted by ['id'], though.
-                tmp.append(pd.to_datetime(new_date, format='%d.%m.%Y.%H.%M.%S'))
-            
-            except Exception as ex:
-                print('\tFAILED to handle timestamp format exception: ', ex)
-            
-            else:
-                print('\tSUCCEEDED in handling exception for timestamp format.')
-                pass
+    return keys
 
-    return tmp
+def load_snapshot(snapshot_dir, mmap=True, start=None, end=None, series=None):
+    '''
+    Loads the snapshot into a dataframe like the one load_testresults_todataframe() returns (None if there is no snapshot),
+    with its text columns as categoricals. The whole snapshot, or the rows tested from start to end (both included, days),
+    is read from the consolidated segments. With series only the partitions it overlaps are read (see snapshot_partitions()).
+    '''
+    meta = load_snapshot_meta(snapshot_dir)
+    if meta is None or not meta['partitions']:
+        return None
 
-def parse_benchmark_state(df):
+    if start is None and end is None and series is None:
+        frames = [read_segment(snapshot_dir, CONSOLIDATED, segment, mmap) for segment in meta[CONSOLIDATED]]
+
+    elif series is None:
+        frames = [read_consolidated_window(snapshot_dir, segment, start, end, mmap) for segment in meta[CONSOLIDATED]]
+
+    else:
+        frames = [read_partition(snapshot_dir, key, meta['partitions'][key], mmap) for key in snapshot_partitions(meta, start, end, series)]
+
+    if not frames:
+        # no rows, but the columns of the snapshot
+        frames = [read_segment(snapshot_dir, CONSOLIDATED, meta[CONSOLIDATED][0], mmap).iloc[:0]]
+
+    # segments are merged back into the order of a full load
+    return sort_by_id(concat_frames(frames, ignore_index=True)) if len(frames) > 1 else frames[0]
+
+def sort_by_id(df):
     '''
-    Parses the number of failed tests for each Orion device in the dataframe
-    Returns a list of states that can be used to create a new column in the dataframe
+    Rows of df in the order build_testresults_dataframe() sorts them: by 'id', descending, with the rows without one last
+    and ties kept in their order. Dictionary encoded serials are sorted through their categories, without decoding them.
     '''
-    list_of_states = []
-    for index, value in df.iterrows():
-        try:
-            if 'good' in str(value.overall):
-                list_of_states.append('passed')
-        
-            elif 'bad' in str(value.overall):
-                list_of_states.append('failed_{}'.format((value.value_counts().bad - 1)))
+    ids = df['id']
+    if not pd.api.types.is_categorical_dtype(ids.dtype):
+        return df.sort_values(by=['id'], ascending=False, kind='mergesort').reset_index(drop=True)
+
+    # descending rank of every serial, missing ones (code -1) take the last rank
+    categories = ids.cat.categories.values.astype(str)
+    ranks = np.empty(len(categories) + 1, dtype=np.int64)
+    ranks[np.argsort(categories, kind='mergesort')[::-1]] = np.arange(len(categories))
+    ranks[-1] = len(categories)
 
-            elif 'nan' in str(value.overall):
-                list_of_states.append('nan')
+    order = np.argsort(ranks[ids.cat.codes.values], kind='mergesort')
 
-        except Exception as e:
-            print('BENCHMARK_STATE_PARSER_ERROR:', value)
-            print(pd.isnull(value).value_counts())
+    return df.iloc[order].reset_index(drop=True)
 
-    return list_of_states
 
-def load_testresults_todataframe(path, is_csv=False):
+# ---------------------- AUX METHODS FOR WINDOW QUERIES -------------------------- #
+# The frames of the dashboard are indexed by 'created_at' and sorted once, when they are published (see DatasetStore).
+# A date range is then resolved to a pair of row positions by binary search over the datetime64 values of the index,
+# and the rows come back as a positional slice that shares the memory of the frame: O(log n) plus the rows picked.
+
+def window_bounds(times: np.ndarray, start=None, end=None) -> tuple:
     '''
-    FUTURE feature:
-        handle single files (txt, csv and json)
+    Positions (i, j) such that times[i:j] are the timestamps from start up to end (excluded), times being a sorted
+    datetime64 array such as df.index.values. start or end None leaves that side open.
     '''
-    # parses the text files into a list of dictionaries that will be used to create the dataframe
-    list_of_dicts = []
-    for txt_file in os.listdir(path):
-        from_file = parse_test_results(txt_file)
+    i = 0 if start is None else int(np.searchsorted(times, pd.Timestamp(start).to_datetime64(), side='left'))
+    j = len(times) if end is None else int(np.searchsorted(times, pd.Timestamp(end).to_datetime64(), side='left'))
 
-        list_of_dicts.append(extend_test_results(from_file))
-    
-    # creates the dataframe
-    df = pd.DataFrame(list_of_dicts)
+    return i, max(i, j)
 
-    # sort by ['id'] to enable extra error handling in parse_timestamp_series()
-    df.sort_values(by=['id'], inplace=True, ascending=False, kind='mergesort')
-    df.reset_index(inplace=True, drop=True)
+def window_rows(df: pd.DataFrame, start=None, end=None, states=None, ids=None) -> pd.DataFrame:
+    '''
+    Rows of df (sorted by its 'created_at' index) tested from start up to end (excluded), as a slice sharing the memory
+    of df. With states or ids (empty means all), only the rows of the window in those states or of those devices.
+    The rows returned must not be modified in place.
+    '''
+    i, j = window_bounds(df.index.values, start, end)
+    df = df.iloc[i:j]
 
-    # standardizes the timestamp format in 'created_at' and transforms to datetime
-    df.created_at = clean_timestamp_series(df.created_at)
-    df.created_at = pad_timestamp_series(df.created_at)
-    df.created_at = parse_timestamp_series(df.created_at)
+    if states:
+        df = df[df.state.isin(states).values]
 
-    # finds and drop rows that have no valid field
-    df.replace(to_replace='nan', value=np.nan, inplace=True)
-    df.dropna(how='all', inplace=True)
-    
-    # extends the dataframe to have columns states (the number of failed tests if any, or passed if none)
-    df['state'] = parse_benchmark_state(df)
+    if ids:
+        df = df[df.id.isin(ids).values]
 
     return df
 
 
 # ---------------------- AUX METHODS FOR DASHBOARD -------------------------- #
 
+# above WINDROSE_GL_POINTS devices the windrose is drawn with WebGL, above WINDROSE_POINT_BUDGET devices are binned
+WINDROSE_GL_POINTS = 1000
+WINDROSE_POINT_BUDGET = 5000
+WINDROSE_COLORS = dict(passed='#009f00', failed_1='#ebaca2', failed_2='#e0907a', failed_3='#ce6a6b', failed_all='#ba4c49', nan='#4a919e')
+
+def device_angles(ids):
+    '''
+    Angle (in degrees) of each device around the pole, derived from a hash of its serial so the layout is the same on every render
+    '''
+    hashes = pd.util.hash_pandas_object(pd.Series(ids, dtype=object).astype(str), index=False).values
+
+    return (hashes % 36000) / 100
+
+def windrose_points(ids):
+    '''
+    Radius, angle and hover text of each device of a state (devices spiral outwards in the order they were tested)
+    '''
+    ids = pd.Series(ids, dtype=object).astype(str)
+
+    return np.arange(len(ids)) * 2 + 10, device_angles(ids), ('Id: ' + ids).values
+
+def windrose_bins(ids, max_points, n_rings=8):
+    '''
+    Aggregates the devices of a state into at most max_points (ring x sector) bins.
+    Returns the radius and angle of the center of each non-empty bin, the number of devices in it and the hover text.
+    '''
+    r, theta, _ = windrose_points(ids)
+    n_sectors = max(12, max_points // n_rings)
+
+    ring_width = (r.max() - r.min()) / n_rings + 1
+    rings = ((r - r.min()) // ring_width).astype(int)
+    sectors = (theta // (360 / n_sectors)).astype(int)
+
+    counts = pd.Series(1, index=pd.MultiIndex.from_arrays([rings, sectors])).groupby(level=[0, 1]).sum()
+    bin_rings, bin_sectors = counts.index.get_level_values(0).values, counts.index.get_level_values(1).values
+
+    return (r.min() + (bin_rings + 0.5) * ring_width, (bin_sectors + 0.5) * 360 / n_sectors, counts.values,
+            ['{} devices'.format(x) for x in counts.values])
+
 # testing out typing (https://docs.python.org/3/library/typing.html)
-def update_windroseplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_focus: Any) -> dict:
+def update_windroseplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_focus: Any,
+                        gl_points: int = WINDROSE_GL_POINTS, point_budget: int = WINDROSE_POINT_BUDGET) -> dict:
     '''
+    Large selections are drawn with WebGL (Scatterpolargl) above gl_points devices and binned above point_budget devices,
+    so the size of the figure stays bounded whatever the date range
     '''
-    colors = dict(passed='#009f00', failed_1='#ebaca2', failed_2='#e0907a', failed_3='#ce6a6b', failed_all='#ba4c49', nan='#4a919e')
+    colors = WINDROSE_COLORS
 
-    end = end + timedelta(days=1)
+    # every device tested from the start date up to the end of the end date
+    df = window_rows(in_df, start, end + timedelta(days=1), ids=in_focus)
 
-    if not in_focus:
-        df = in_df.copy()
-        df = df.loc[start : end]    
+    # one grouped pass, states in the same order as the overview chart (plain and compact frames give the same figure)
+    ids_per_state = dict((state, ids.values) for state, ids in df.groupby('state', sort=False, observed=True).id)
+    ids_per_state = [(state, ids_per_state[state]) for state in sort_states(ids_per_state)]
 
-    else:
-        df = in_df[(in_df.id.isin(in_focus))].copy()
-        df = df.loc[start : end]
+    scatter = go.Scatterpolargl if len(df) > gl_points else go.Scatterpolar
+    binned = len(df) > point_budget
 
-        
+    data = []
+    for state, ids in ids_per_state:
+        marker = dict(
+            color = colors.get(state, colors['failed_all']),
+            size = 20,
+            opacity=0.75,
+            line = dict(
+                color = "black"
+            ),
+        )
 
-    return {
-        'data': [
-            go.Scatterpolar(
-                r = [x*2 for x in range(5, len(df.loc[df.state==state])+5)],
-                theta = [360*x for x in np.random.rand(len(df.loc[df.state==state]))],
-                text=['Id: {}'.format(str(x)) for x in df.loc[df.state==state, 'id'].values],
+        if binned:
+            r, theta, counts, text = windrose_bins(ids, max(1, point_budget // len(ids_per_state)))
+            # the area of a bin's marker grows with the number of devices in it
+            marker['size'] = 8 + 22 * np.sqrt(counts / counts.max())
+
+        else:
+            r, theta, text = windrose_points(ids)
+
+        data.append(
+            scatter(
+                r = r,
+                theta = theta,
+                text = text,
                 hoverinfo = 'text',
                 name=state,
                 mode = 'markers',
-                marker = dict(
-                    color = colors[state],
-                    size = 20,
-                    opacity=0.75,
-                    line = dict(
-                        color = "black"
-                    ),
-                ),
-            ) for state in df.state.unique()
-        ],
+                marker = marker,
+            )
+        )
+
+    return {
+        'data': data,
         'layout': go.Layout(
             title='Orion Devices',
             font=dict(size=18),
@@ -353,84 +1337,73 @@ def update_windroseplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_fo
         )
     }
 
-def update_barplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_focus: Any) -> dict:
+def sort_states(states):
     '''
+    Sorts states as 'passed', 'failed_1', 'failed_2', ... and anything else ('nan') last
     '''
-    colors = dict(passed='#bed3c3', failed_1='#ebaca2', failed_2='#e0907a', failed_3='#ce6a6b', failed_all='#ba4c49', nan='#4a919e')
+    def key(state):
+        if state == 'passed':
+            return (0, 0)
 
-    end = end + timedelta(days=1)
-    
-    if not in_focus:
-        df = in_df.copy()
-        df = df.loc[start : end]    
+        elif str(state).startswith('failed_') and str(state)[7:].isdigit():
+            return (1, int(state[7:]))
+
+        return (2, 0)
+
+    return sorted(states, key=key)
+
+def daily_state_counts(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Counts the devices in each state per day in a single grouped pass
+    Returns a (day x state) dataframe, with the states sorted by sort_states()
+    '''
+    if df.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([]))
+
+    # categorical states (see to_compact()) are counted as plain labels, so unused categories don't show up as columns
+    states = df.state.astype(object) if pd.api.types.is_categorical_dtype(df.state.dtype) else df.state
+    counts = pd.crosstab(df.index.normalize(), states.values)
+    counts.index.name, counts.columns.name = 'created_at', 'state'
 
+    return counts[sort_states(counts.columns)]
+
+def daily_subtest_failures(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Counts the failed sub-tests per day, returns a (day x sub-test) dataframe
+    '''
+    if 'failed_subtests' in df.columns:
+        failed = unpack_failed_subtests(df.failed_subtests.values).set_index(df.index)
     else:
-        df = in_df[(in_df.state.isin(in_focus))].copy()
-        df = df.loc[start : end]
+        failed = df.reindex(columns=SUBTESTS) == 'bad'
 
-    # for each state in 'in_focus', we plot 'td' days around the pole
-    overall_s = df.state.unique()
-    overall_series = {}
-    
-    for feat in overall_s:
-        overall_series[feat] = df[(df.state==feat)].state.resample('D').count().replace(0, np.nan).dropna()
-    
-    # for each day, calculate the failure rate
-    if not in_focus or (any(['failed' in x for x in in_focus]) and any(['passed' in x for x in in_focus])):
-        fail_rate = {}
-        for date in np.unique(df.index.date):
-            d = date.strftime('%Y-%m-%d')
-            fail_n = sum([y for (x,y) in zip(df[d].state.value_counts().index, df[d].state.value_counts().values) if 'fail' in x])
-
-            if df[d].state.value_counts()['passed'] > 0:
-                fail_rate[date.strftime('%b %d')] = (fail_n  / (df[d].state.value_counts()['passed'] + fail_n))*100
-            
-            else:
-                fail_rate[date] = 1
+    return failed.groupby(df.index.normalize()).sum().astype(int)
 
-        # calculate the standard deviation for the series
-        std = np.std(list(fail_rate.values()))
+def daily_fail_rate(counts: pd.DataFrame) -> pd.Series:
+    '''
+    Percentage of failed devices over passed + failed ones for each day of a (day x state) table
+    Days without passed or failed devices are left out
+    '''
+    fail_n = counts[[x for x in counts.columns if 'fail' in x]].sum(axis=1)
+    tested_n = fail_n + (counts['passed'] if 'passed' in counts.columns else 0)
 
-    # define data properties for our chart
-    my_data = [
-        go.Bar(
-                #x = overall_series[state].index,
-                x = [x.strftime('%b %d') for x in np.unique(overall_series[state].index.date)],
-                y = overall_series[state].values,
-                text = [str(x) for x in overall_series[state].values],
-                hoverinfo = 'text',
-                textposition = 'auto',
-                opacity=1,
-                marker=dict(color=colors[state]),
-                name=state,
-                
-            ) for state in overall_series.keys()
-    ]
-    if not in_focus or (any(['failed' in x for x in in_focus]) and any(['passed' in x for x in in_focus])):
-        my_data.extend([
-            go.Scatter(
-                mode='lines',
-                x = [x for x in fail_rate.keys()],
-                y = list(fail_rate.values()),
-                name='Fail Rate ± Standard Deviation',
-                hoverinfo = 'text',
-                text=[(re.search(r'(?<=\.)(\d){2}', str(x)).group(0)+'% ± '+str(y)) for (x, y) in zip(list(fail_rate.values()), [std]*len(list(fail_rate.values())))],
-                yaxis='y2',
-                error_y=dict(
-                    type='percent',
-                    value=std,
-                    #type='data',
-                    #array=[std]*len(list(fail_rate.values())),
-                    visible=True
-                ),
-                marker=dict(color='#c97b42')
+    return (fail_n / tested_n * 100)[tested_n > 0]
 
-            ),
+def update_barplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_focus: Any) -> dict:
+    '''
+    '''
+    # every device tested from the start date up to the end of the end date
+    df = window_rows(in_df, start, end + timedelta(days=1), states=in_focus)
 
-        ])
+    # counts of every state per day, in one grouped pass
+    return update_barplot_from_counts(daily_state_counts(df), in_focus)
+
+BARPLOT_COLORS = dict(passed='#bed3c3', failed_1='#ebaca2', failed_2='#e0907a', failed_3='#ce6a6b', failed_all='#ba4c49', nan='#4a919e')
 
-    # define layout properties for our chart
-    layout = go.Layout(
+def barplot_layout():
+    '''
+    Layout of the overview chart (also used by the clientside version in assets/overview.js)
+    '''
+    return go.Layout(
         title= ('Overview'),
         titlefont=dict(
             family='Courier New, monospace',
@@ -485,8 +1458,330 @@ def update_barplot(in_df: pd.DataFrame, start: dt.date, end: dt.date, in_focus:
         )
     )
 
-    return go.Figure(data=my_data, layout=layout)
+def update_barplot_from_counts(counts: pd.DataFrame, in_focus: Any) -> dict:
+    '''
+    Builds the overview chart from a (day x state) table of counts, such as the ones of daily_state_counts() or a DailyRollup
+    '''
+    colors = BARPLOT_COLORS
+
+    if in_focus:
+        counts = counts[[x for x in counts.columns if x in in_focus]]
+
+    # days and states without any device are left out
+    counts = counts[(counts > 0).any(axis=1)]
+    counts = counts.loc[:, (counts > 0).any(axis=0)]
+
+    # for each day, calculate the failure rate
+    show_fail_rate = not in_focus or (any(['failed' in x for x in in_focus]) and any(['passed' in x for x in in_focus]))
+    if show_fail_rate:
+        fail_rate = daily_fail_rate(counts)
+
+        # calculate the standard deviation for the series (0 if there are no days in the window)
+        std = np.std(fail_rate.values) if len(fail_rate) else 0
+
+    # define data properties for our chart (only the days where the state shows up)
+    my_data = [
+        go.Bar(
+                x = [x.strftime('%b %d') for x in counts.index[counts[state] > 0]],
+                y = counts.loc[counts[state] > 0, state].values,
+                text = [str(x) for x in counts.loc[counts[state] > 0, state].values],
+                hoverinfo = 'text',
+                textposition = 'auto',
+                opacity=1,
+                marker=dict(color=colors.get(state, colors['failed_all'])),
+                name=state,
+                
+            ) for state in counts.columns
+    ]
+    if show_fail_rate:
+        my_data.extend([
+            go.Scatter(
+                mode='lines',
+                x = [x.strftime('%b %d') for x in fail_rate.index],
+                y = fail_rate.values,
+                name='Fail Rate ± Standard Deviation',
+                hoverinfo = 'text',
+                text=['{:.2f}% ± {:.2f}'.format(x, std) for x in fail_rate.values],
+                yaxis='y2',
+                error_y=dict(
+                    type='percent',
+                    value=std,
+                    #type='data',
+                    #array=[std]*len(list(fail_rate.values())),
+                    visible=True
+                ),
+                marker=dict(color='#c97b42')
+
+            ),
+
+        ])
+
+    return go.Figure(data=my_data, layout=barplot_layout())
+
+def daily_counts_payload(counts: pd.DataFrame) -> dict:
+    '''
+    The (day x state) counts of a DailyRollup in the form the clientside overview (assets/overview.js) rebuilds the
+    chart of update_barplot_from_counts() from: days as 'YYYY-MM-DD', one list of counts per state, colors and layout
+    '''
+    return dict(
+        days=[x.strftime('%Y-%m-%d') for x in counts.index],
+        states=[str(x) for x in counts.columns],
+        counts={str(state): counts[state].astype(int).tolist() for state in counts.columns},
+        colors=BARPLOT_COLORS,
+        layout=barplot_layout(),
+    )
+
+def daily_counts_delta(counts: pd.DataFrame, days) -> dict:
+    '''
+    The counts of a DailyRollup on the given days only, for the live overview (assets/live.js) to merge into the payload of
+    daily_counts_payload(). Counts are absolute, not increments, and states lists every state of the rollup.
+    '''
+    counts = counts.reindex(pd.DatetimeIndex(days).normalize().unique(), fill_value=0)
+
+    return dict(
+        days=[x.strftime('%Y-%m-%d') for x in counts.index],
+        states=[str(x) for x in counts.columns],
+        counts={str(state): counts[state].astype(int).tolist() for state in counts.columns},
+    )
+
+def windrose_delta(df: pd.DataFrame) -> dict:
+    '''
+    Rows appended to the frame, in the form the live overview (assets/live.js) appends them to the windrose of update_windroseplot():
+    day, state, serial and angle of each row, in the order they were tested
+    '''
+    ids = df.id.astype(str).values
+
+    return dict(
+        days=[x.strftime('%Y-%m-%d') for x in df.index],
+        states=[str(x) for x in df.state.values],
+        ids=ids.tolist(),
+        angles=device_angles(ids).tolist(),
+        colors=WINDROSE_COLORS,
+    )
+
+
+# ---------------------- AUX METHODS FOR THE DEVICE TABLE -------------------------- #
+
+# one term of the filter query of dash_table.DataTable, e.g. {id} contains f072 or {response} eq "bad"
+FILTER_TERM = re.compile(r'^\{((?:[^{}\\]|\\.)+)\}\s*(!=|<=|<|>=|>|=|(?:ne|le|lt|ge|gt|eq|contains|datestartswith)(?=\s|$))?\s*(.*)$', re.IGNORECASE)
+FILTER_OPERATORS = {'!=': 'ne', '<=': 'le', '<': 'lt', '>=': 'ge', '>': 'gt', '=': 'eq'}
+
+def parse_table_filter(query: str) -> list:
+    '''
+    Splits the filter query of the table into (column, operator, value) terms.
+    Terms that can't be parsed are skipped instead of failing the whole query.
+    '''
+    terms = []
+    for term in re.split(r'\s+(?:&&|and)\s+', query or '', flags=re.IGNORECASE):
+        match = FILTER_TERM.match(term.strip())
+
+        if match is None:
+            if term.strip():
+                print('TABLE_FILTER_WARNING: ignoring', term)
+            continue
+
+        column, operator, value = match.groups()
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"`':
+            value = value[1:-1]
+
+        operator = (operator or 'contains').lower()
+        terms.append((re.sub(r'\\(.)', r'\1', column), FILTER_OPERATORS.get(operator, operator), value))
+
+    return terms
+
+def filter_table(df: pd.DataFrame, query: str) -> pd.DataFrame:
+    '''
+    Rows of df matching every term of the filter query (columns are compared as text, case-insensitive)
+    '''
+    terms = parse_table_filter(query)
+    df = with_subtests(df, [column for column, _, _ in terms])
+    mask = np.ones(len(df), dtype=bool)
+
+    for column, operator, value in terms:
+        if column not in df.columns:
+            continue
+
+        values = df[column].astype(str).str.lower()
+        value = value.lower()
+
+        if operator == 'contains':
+            mask &= values.str.contains(value, regex=False).values
+        elif operator == 'datestartswith':
+            mask &= values.str.startswith(value).values
+        else:
+            mask &= getattr(values, operator)(value).values
+
+    return df.loc[mask]
+
+def sort_table(df: pd.DataFrame, sort_by: list) -> pd.DataFrame:
+    '''
+    Sorts df by the sort_by property of the table ([{'column_id': ..., 'direction': 'asc' | 'desc'}, ...])
+    '''
+    df = with_subtests(df, [x.get('column_id') for x in sort_by or []])
+    sort_by = [x for x in sort_by or [] if x.get('column_id') in df.columns]
+    if not sort_by:
+        return df
+
+    return df.sort_values(
+        [x['column_id'] for x in sort_by],
+        ascending=[x.get('direction') != 'desc' for x in sort_by],
+        kind='mergesort',
+    )
+
+def table_page(df: pd.DataFrame, current_page: int, page_size: int) -> tuple:
+    '''
+    Rows of the requested page (or of the last page if current_page is past the end), that page and the number of pages
+    '''
+    last_page = max(0, (len(df) - 1) // page_size)
+    current_page = min(max(0, current_page or 0), last_page)
+
+    return df.iloc[current_page * page_size : (current_page + 1) * page_size], current_page, last_page + 1
+
+# ---------------------- AUX METHODS FOR THE COMPACT FRAME -------------------------- #
+
+# compact frames keep the overall results as categoricals (1 byte per row) and pack the sub-tests of each device into
+# a bitmask: bit i is set when SUBTESTS[i] is 'bad', bit i + 4 when it has no result. A sub-test column is only kept
+# (as a categorical) if it holds other values, which the bitmask can't tell apart
+RESULT_FIELDS = SUBTESTS + ['overall']
+SUBTEST_BITS = np.array([1 << i for i in range(len(SUBTESTS))], dtype=np.uint8)
+SUBTEST_MISSING_BITS = SUBTEST_BITS << len(SUBTESTS)
+
+def pack_failed_subtests(df: pd.DataFrame) -> np.ndarray:
+    '''
+    '''
+    results = df.reindex(columns=SUBTESTS)
+    failed = (results == 'bad').values
+    missing = results.isnull().values
+
+    return ((failed * SUBTEST_BITS).sum(axis=1) | (missing * SUBTEST_MISSING_BITS).sum(axis=1)).astype(np.uint8)
+
+def unpack_failed_subtests(bitmask) -> pd.DataFrame:
+    '''
+    (row x sub-test) booleans of a bitmask made by pack_failed_subtests()
+    '''
+    bitmask = np.asarray(bitmask)
+
+    return pd.DataFrame({feature: (bitmask & bit) != 0 for feature, bit in zip(SUBTESTS, SUBTEST_BITS)})
+
+def unpack_subtest_results(bitmask, features=SUBTESTS) -> OrderedDict:
+    '''
+    'good', 'bad' or NaN of each sub-test in features, as they were before pack_failed_subtests()
+    '''
+    bitmask = np.asarray(bitmask)
+
+    results = OrderedDict()
+    for feature in features:
+        i = SUBTESTS.index(feature)
+        values = np.where(bitmask & SUBTEST_BITS[i], 'bad', 'good').astype(object)
+        values[(bitmask & SUBTEST_MISSING_BITS[i]) != 0] = np.nan
+        results[feature] = values
+
+    return results
+
+def with_subtests(df: pd.DataFrame, columns) -> pd.DataFrame:
+    '''
+    df with the sub-tests among columns a compact frame has no column for rebuilt from its bitmask (e.g. to filter the table by them)
+    '''
+    features = [x for x in SUBTESTS if x in columns and x not in df.columns]
+    if not features or 'failed_subtests' not in df.columns:
+        return df
+
+    return df.assign(**unpack_subtest_results(df.failed_subtests.values, features))
+
+def to_compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Compact copy of a frame made by load_testresults_todataframe(): results, states and (repeated) serials become categoricals,
+    'created_at' datetime64 and the sub-tests are packed in 'failed_subtests'. Frames already compact are returned as is.
+    '''
+    if 'failed_subtests' in df.columns:
+        return df
+
+    compact = pd.DataFrame(index=df.index)
+    for column in df.columns:
+        # rebuilt by from_compact() unless it holds results other than 'good', 'bad' or none
+        if column in SUBTESTS and (df[column].isin(['good', 'bad']) | df[column].isnull()).all():
+            continue
+
+        elif column in RESULT_FIELDS:
+            compact[column] = pd.Categorical(df[column])
+
+        # serials only pay off as a categorical when devices are tested several times
+        elif column == 'id':
+            compact[column] = pd.Categorical(df[column]) if df[column].nunique() <= len(df) // 2 else df[column]
+
+        elif column == 'state':
+            compact[column] = pd.Categorical(df[column], categories=sort_states(df[column].dropna().unique()), ordered=True)
+
+        elif column == 'created_at':
+            compact[column] = pd.to_datetime(df[column])
+
+        else:
+            compact[column] = df[column]
+
+    compact['failed_subtests'] = pack_failed_subtests(df)
+
+    return compact
+
+def concat_frames(frames, ignore_index=False) -> pd.DataFrame:
+    '''
+    pd.concat() of frames with the same columns that keeps their categoricals: the categories are merged and the codes
+    remapped, pd.concat() decodes the whole column as soon as the categories differ. A column is categorical if it is in
+    the first frame (e.g. the serials of a compact frame a few rows are appended to). Ordered categoricals are states,
+    their categories are sorted with sort_states().
+    '''
+    if len(frames) == 1:
+        return frames[0]
+
+    data = OrderedDict()
+    for column in frames[0].columns:
+        values = [x[column].values for x in frames]
+
+        if not isinstance(values[0], pd.Categorical):
+            data[column] = np.concatenate([np.asarray(x, dtype=object) if isinstance(x, pd.Categorical) else x for x in values])
+            continue
+
+        values = [x if isinstance(x, pd.Categorical) else pd.Categorical(x) for x in values]
+        if values[0].ordered:
+            categories = sort_states(pd.Index(np.concatenate([x.categories.values for x in values])).unique())
+            values = [x.set_categories(categories).as_ordered() for x in values]
+
+        data[column] = union_categoricals(values)
+
+    index = None if ignore_index else frames[0].index.append([x.index for x in frames[1:]])
+
+    return pd.DataFrame(data, index=index)
+
+def from_compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Back to the layout of load_testresults_todataframe() (object columns, sub-tests first, no bitmask), e.g. for the rows sent to the table
+    '''
+    if 'failed_subtests' not in df.columns:
+        return df
+
+    df = with_subtests(df, SUBTESTS)
+    df = df.reindex(columns=[x for x in SUBTESTS if x in df.columns] + [x for x in df.columns if x not in SUBTESTS and x != 'failed_subtests'])
+    for column in df.columns:
+        if pd.api.types.is_categorical_dtype(df[column].dtype):
+            df[column] = df[column].astype(object)
+
+    return df
+
+def memory_report(df: pd.DataFrame, compact: pd.DataFrame = None) -> pd.DataFrame:
+    '''
+    Bytes used by each column of df and of its compact version, with a 'total' row
+    '''
+    compact = to_compact(df) if compact is None else compact
+    df = from_compact(df)
+
+    report = pd.DataFrame({
+        'object': df.memory_usage(index=False, deep=True),
+        'compact': compact.memory_usage(index=False, deep=True),
+    }).fillna(0).astype(int)
+    report.loc['total'] = report.sum()
+    report['ratio'] = (report.object / report.compact.replace(0, np.nan)).round(1)
 
+    return report
 
 # debugging purposes -------------------------------------------------------------------
 if __name__ == '__main__':
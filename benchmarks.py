@@ -0,0 +1,486 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import aux_methods as aux
+from datastore import SharedDatasetStore
+from synthetic_data import DEFECTS, clio_text, generate_results, write_clio_files
+
+
+# ---------------------- REFERENCE IMPLEMENTATIONS -------------------------- #
+def parse_benchmark_state_rowwise(df):
+    '''
+    Row-wise implementation that aux.parse_benchmark_state replaced, kept as a reference
+    '''
+    list_of_states = []
+    for index, value in df.iterrows():
+        if 'good' in str(value.overall):
+            list_of_states.append('passed')
+
+        elif 'bad' in str(value.overall):
+            list_of_states.append('failed_{}'.format((value.value_counts().bad - 1)))
+
+        elif 'nan' in str(value.overall):
+            list_of_states.append('nan')
+
+    return list_of_states
+
+
+def parse_row_repairing(fname, from_file):
+    '''
+    Parser path every file went through before aux.parse_row_fast(), kept as a reference
+    '''
+    return aux.to_row(aux.extend_test_results(aux.parse_test_results(fname, None, from_file)))
+
+
+# ---------------------- BENCHMARK DATA -------------------------- #
+def random_results_dataframe(n_rows, seed=0):
+    '''
+    Builds a dataframe shaped like the output of load_testresults_todataframe() (minus 'state'),
+    with ~5% failed sub-tests and a few devices without an overall result
+    '''
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        feature: np.where(rng.rand(n_rows) < 0.05, 'bad', 'good').astype(object) for feature in aux.SUBTESTS
+    })
+    df['created_at'] = pd.Timestamp('2018-09-01') + pd.to_timedelta(rng.randint(0, 60*86400, n_rows), unit='s')
+    df['overall'] = np.where((df[aux.SUBTESTS] == 'bad').any(axis=1), 'bad', 'good').astype(object)
+    df.loc[rng.rand(n_rows) < 0.001, 'overall'] = np.nan
+    df['id'] = ['f072-{:05d}'.format(x % 100000) for x in range(n_rows)]
+
+    return df
+
+
+def timed(func, *args, **kwargs):
+    '''
+    '''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# ---------------------- BENCHMARKS -------------------------- #
+def bench_suite(sizes, out=None, n_jobs=1, defect_rate=0.02, archive=False, window_days=7):
+    '''
+    End-to-end run over synthetic CLIO files: generation, load, state derivation, publishing and the dashboard callbacks
+    of app.py (called as Dash calls them) on the last `window_days` days of production, with the size of their responses.
+    Results are printed and, if out is given, written there as json.
+    '''
+    results = []
+    out = os.path.abspath(out) if out else None
+
+    def record(n_files, stage, seconds, size=None):
+        results.append(dict(files=n_files, stage=stage, seconds=round(seconds, 6), bytes=size))
+        print('{:>10} {:<16} {:>10.4f} {:>12}'.format(n_files, stage, seconds, '-' if size is None else size))
+
+    # the app boots on an empty scratch directory, the datasets of the benchmark are published to its store
+    scratch, cwd = tempfile.mkdtemp(), os.getcwd()
+    os.environ.update(WATCH_UPLOADS='0', SHARED_DATASET='0', CLIENTSIDE_OVERVIEW='0', LIVE_OVERVIEW='0')
+    os.chdir(scratch)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
+
+    print('{:>10} {:<16} {:>10} {:>12}'.format('files', 'stage', 'time [s]', 'size [B]'))
+
+    for n_files in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            truth, elapsed = timed(write_clio_files, workdir, n_files, defect_rate=defect_rate, archive='results.zip' if archive else None)
+            record(n_files, 'generate', elapsed)
+
+            df, elapsed = timed(aux.load_testresults_todataframe, workdir, n_jobs=n_jobs)
+            record(n_files, 'load', elapsed)
+
+            _, elapsed = timed(aux.parse_benchmark_state, df)
+            record(n_files, 'state', elapsed)
+
+            version, elapsed = timed(app.DATASETS.publish, df)
+            record(n_files, 'publish', elapsed)
+
+            # the last days of the ground truth: the rollup's last day can be a misread (day/month swapped) timestamp
+            end = truth.created_at.max().normalize()
+            start_date, end_date = str((end - pd.Timedelta(days=window_days - 1)).date()), str(end.date())
+
+            # update_graph1 reads the callback context, the callbacks run in a request as they do in the app
+            with app.server.test_request_context():
+                response, elapsed = timed(app.update_datepicker, version)
+                record(n_files, 'datepicker', elapsed, len(response))
+
+                response, elapsed = timed(app.update_dropdown_states, version, 'd_specs', start_date, end_date, None)
+                record(n_files, 'dropdown', elapsed, len(response))
+
+                options = json.loads(response)['response']['dropdown-select']['options']
+
+                response, elapsed = timed(app.update_graph1, version, start_date, end_date, None, 'f_rate')
+                record(n_files, 'graph1_f_rate', elapsed, len(response))
+
+                response, elapsed = timed(app.update_graph1, version, start_date, end_date, None, 'd_specs')
+                record(n_files, 'graph1_d_specs', elapsed, len(response))
+
+                response, elapsed = timed(
+                    app.update_table, None, [x['value'] for x in options[:20]], dict(current_page=0, page_size=25),
+                    [{'column_id': 'id', 'direction': 'asc'}], '{state} contains pass', version, 'd_specs', start_date, end_date,
+                )
+                record(n_files, 'table', elapsed, len(response))
+
+        finally:
+            shutil.rmtree(workdir)
+
+    if out:
+        with open(out, 'w') as f:
+            json.dump(dict(
+                created_at=pd.Timestamp.now().isoformat(), python=platform.python_version(), pandas=pd.__version__,
+                n_jobs=n_jobs, defect_rate=defect_rate, archive=archive, results=results,
+            ), f, indent=1)
+
+    return results
+
+
+def bench_state(sizes, rowwise_limit):
+    '''
+    Times the vectorized state derivation against the row-wise one and checks that both give the same labels
+    '''
+    print('{:>10} {:>14} {:>14} {:>10}'.format('rows', 'vectorized [s]', 'row-wise [s]', 'speedup'))
+
+    for n_rows in sizes:
+        df = random_results_dataframe(n_rows)
+        states, vectorized = timed(aux.parse_benchmark_state, df)
+
+        if n_rows <= rowwise_limit:
+            reference, rowwise = timed(parse_benchmark_state_rowwise, df)
+            assert states.tolist() == reference, 'vectorized states differ from the row-wise ones'
+            print('{:>10} {:>14.4f} {:>14.4f} {:>9.0f}x'.format(n_rows, vectorized, rowwise, rowwise / vectorized))
+
+        else:
+            print('{:>10} {:>14.4f} {:>14} {:>10}'.format(n_rows, vectorized, '-', '-'))
+
+
+# layouts aux.parse_row_fast() must leave to the repairing parser (returning None), and one it must take
+PARSER_REJECTS = [
+    ('missing UNIT line', '1 GOOD SIN\r\n   Response GOOD\r\n   Polarity GOOD\r\n   RUB+BUZZ GOOD\r\n   THD GOOD\r\n17.10.2018 13.07.41\r\n'),
+    ('truncated timestamp', '1 BAD SIN\r\n   Response BAD\r\n   Polarity GOOD\r\n   RUB+BUZZ GOOD\r\n   THD GOOD\r\n17.10.2018\r\nUNIT N. F072-00737 BAD\r\n'),
+    ('missing sub-test line', '1 GOOD SIN\r\n   Response GOOD\r\n   Polarity GOOD\r\n   THD GOOD\r\n17.10.2018 13.07.41\r\nUNIT N. F072-00737 GOOD\r\n'),
+    ('unknown sub-test result', '1 GOOD SIN\r\n   Response OK\r\n   Polarity GOOD\r\n   RUB+BUZZ GOOD\r\n   THD GOOD\r\n17.10.2018 13.07.41\r\nUNIT N. F072-00737 GOOD\r\n'),
+]
+PARSER_ACCEPTS = '1 BAD SIN\r\n   Response BAD\r\n   Polarity GOOD\r\n   RUB+BUZZ GOOD\r\n   THD GOOD\r\n17.10.2018 13.07.41\r\nUNIT N. F072-00737 BAD\r\n'
+
+# defects (see synthetic_data.DEFECTS) that keep the layout of a file, so they take the fast path (the dates are repaired later on)
+FAST_PATH_DEFECTS = {'swapped_date', 'swapped_date_both'}
+
+
+def parser_corpus(n_files=600, seed=0):
+    '''
+    Fixed synthetic corpus for check_parser(): (fname, content, defect) of n_files files, every other one with the next of DEFECTS
+    '''
+    rng = np.random.RandomState(seed)
+    results = generate_results(n_files, seed=seed)
+    defects = [DEFECTS[i // 2 % len(DEFECTS)] if i % 2 else None for i in range(n_files)]
+    records = results[aux.SUBTESTS + ['overall']].to_dict('records')
+
+    return [(fname, clio_text(serial, timestamp, record, defect, rng), defect)
+            for fname, serial, timestamp, record, defect in zip(results.fname, results.serial, results.created_at, records, defects)]
+
+
+def check_parser(n_files=600, seed=0):
+    '''
+    Differential check of aux.parse_clio_row() against the repairing parser on parser_corpus() (no timing): every file gives
+    the same row, files with a defect that changes their layout and PARSER_REJECTS are left to the repairing parser
+    '''
+    corpus = parser_corpus(n_files, seed)
+
+    for name, text in PARSER_REJECTS:
+        assert aux.parse_row_fast(text) is None, 'parse_row_fast takes a file with a {}'.format(name)
+    assert aux.parse_row_fast(PARSER_ACCEPTS) == parse_row_repairing('f072-00737.txt', PARSER_ACCEPTS), 'parse_row_fast rejects a well-formed file'
+
+    # NaN != NaN, so the rows are compared through their repr
+    mismatches = [fname for fname, text, _ in corpus if repr(aux.parse_clio_row(fname, None, text)) != repr(parse_row_repairing(fname, text))]
+    assert not mismatches, 'parse_clio_row differs from the repairing parser on {}'.format(mismatches[:10])
+
+    fast = [(fname, defect) for fname, text, defect in corpus if aux.parse_row_fast(text) is not None]
+    wrong_path = [fname for fname, defect in fast if defect is not None and defect not in FAST_PATH_DEFECTS]
+    assert not wrong_path, 'parse_row_fast takes files with defects {}'.format(wrong_path[:10])
+    assert len(fast) == sum(defect is None or defect in FAST_PATH_DEFECTS for _, _, defect in corpus), 'parse_row_fast rejects well-formed files'
+
+    print('{} files ({} defects), {} on the fast path, {} rejected layouts: parse_clio_row matches the repairing parser'.format(
+        len(corpus), len(DEFECTS), len(fast), len(PARSER_REJECTS)))
+
+
+def bench_parser(sizes, defect_rate=0.02):
+    '''
+    Throughput of aux.parse_clio_row() and of the repairing parser in files/s on synthetic files (with defects), read from
+    memory so only the parsing is timed. Their rows are checked by check_parser().
+    '''
+    print('{:>10} {:>10} {:>14} {:>14} {:>10}'.format('files', 'fast path', 'reference [/s]', 'parser [/s]', 'speedup'))
+
+    for n_files in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            write_clio_files(workdir, n_files, defect_rate=defect_rate, archive='results.zip')
+            members = list(aux.iter_archive_members(os.path.join(workdir, 'results.zip')))
+        finally:
+            shutil.rmtree(workdir)
+
+        members = [(os.path.basename(name), from_file) for name, from_file in members]
+
+        _, reference_time = timed(lambda: [parse_row_repairing(name, text) for name, text in members])
+        _, parser_time = timed(lambda: [aux.parse_clio_row(name, None, text) for name, text in members])
+
+        n_fast = sum(aux.parse_row_fast(text) is not None for _, text in members)
+        print('{:>10} {:>9.1%} {:>14.0f} {:>14.0f} {:>9.1f}x'.format(
+            n_files, n_fast / n_files, n_files / reference_time, n_files / parser_time, reference_time / parser_time))
+
+
+def bench_partitions(history_days, files_per_day=2000, window_days=14):
+    '''
+    Times reading the last `window_days` days of a partitioned snapshot against reading all of it, for growing histories
+    '''
+    print('{:>8} {:>10} {:>14} {:>14} {:>12}'.format('days', 'rows', 'window [s]', 'full [s]', 'window rows'))
+
+    for days in history_days:
+        df = generate_results(days * files_per_day, days=days).drop(columns=['fname'])
+        df = df.rename(columns=dict(serial='id')).assign(id=lambda x: x.id.str.lower())
+        df['state'] = aux.parse_benchmark_state(df)
+
+        workdir = tempfile.mkdtemp()
+        try:
+            aux.save_snapshot(df, workdir)
+            start = df.created_at.max().normalize() - pd.Timedelta(days=window_days - 1)
+
+            window, window_time = timed(aux.load_snapshot, workdir, start=start)
+            _, full_time = timed(aux.load_snapshot, workdir)
+        finally:
+            shutil.rmtree(workdir)
+
+        print('{:>8} {:>10} {:>14.4f} {:>14.4f} {:>12}'.format(days, len(df), window_time, full_time, len(window)))
+
+
+def bench_memory(sizes):
+    '''
+    Prints the memory used by each column of the parsed frame against its compact version (see aux.to_compact())
+    '''
+    for n_rows in sizes:
+        df = random_results_dataframe(n_rows)
+        df['state'] = aux.parse_benchmark_state(df)
+
+        compact, elapsed = timed(aux.to_compact, df)
+        report = aux.memory_report(df, compact)
+
+        print('{} rows (to_compact in {:.3f}s)'.format(n_rows, elapsed))
+        print((report[['object', 'compact']] / 2**20).round(2).assign(ratio=report.ratio).to_string(), end='\n\n')
+
+
+def memory_usage():
+    '''
+    Proportional set size (shared pages split between the processes mapping them) and private anonymous memory of
+    this process [MiB], from /proc/self/smaps_rollup (Linux only)
+    '''
+    usage = {}
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Pss', 'Anonymous'):
+                usage[key] = int(value.split()[0]) / 1024
+
+    return usage
+
+def attach_worker(mode, path, barrier, results):
+    '''
+    A worker process of bench_shared(): attaches to (or loads its own copy of) the dataset, reads every column and
+    reports how much memory that took once all the workers are up
+    '''
+    before = memory_usage()
+
+    if mode == 'shared':
+        dataset = SharedDatasetStore(path).dataset()
+        frame = dataset.frame
+        dataset.serials.view(np.uint8).sum()
+    else:
+        frame = pd.read_pickle(path)
+
+    # every page of every column is read, as callbacks over the whole history would
+    for column in frame.columns:
+        values = frame[column].cat.codes.values if hasattr(frame[column], 'cat') else frame[column].values
+        values.sum()
+    frame.index.values.max()
+
+    barrier.wait()
+    after = memory_usage()
+    results.put({key: after[key] - before[key] for key in after})
+    barrier.wait()
+
+def bench_shared(n_rows, workers):
+    '''
+    Memory of n worker processes holding the dataset: each with its own copy (as DatasetStore does) against attached to
+    the memory-mapped version published by a SharedDatasetStore
+    '''
+    workdir = tempfile.mkdtemp()
+    df = random_results_dataframe(n_rows)
+    df['state'] = aux.parse_benchmark_state(df)
+
+    # as many devices as a production run of n_rows tests has (a share of them tested again), not a few thousand
+    df['id'] = generate_results(n_rows).serial.str.lower().values
+
+    store = SharedDatasetStore(os.path.join(workdir, 'shared'))
+    store.acquire_loader_lock()
+    _, elapsed = timed(store.publish, df)
+
+    private_path = os.path.join(workdir, 'frame.pkl')
+    pd.to_pickle(store.get().copy(), private_path)
+    print('{} rows, published in {:.3f}s'.format(n_rows, elapsed))
+
+    # fresh interpreters, like the workers of a pre-fork server that import the app after the fork
+    context = multiprocessing.get_context('spawn')
+    for n_workers in workers:
+        for mode, path in [('private', private_path), ('shared', store.path)]:
+            barrier, results = context.Barrier(n_workers), context.Queue()
+            processes = [context.Process(target=attach_worker, args=(mode, path, barrier, results)) for _ in range(n_workers)]
+            for process in processes:
+                process.start()
+
+            usage = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            print('{:>2} workers, {:>7}: total PSS {:8.1f} MiB, private per worker {:7.1f} MiB'.format(
+                n_workers, mode, sum(x['Pss'] for x in usage), np.mean([x['Anonymous'] for x in usage])))
+
+    shutil.rmtree(workdir)
+
+
+def watched_app(workdir, rate, duration, results):
+    '''
+    The process of bench_watcher(): boots the app on workdir/Data/ (watching it for new files), writes `rate` files per
+    second into it and polls for new versions every VERSION_POLL_INTERVAL, as open dashboards do. Reports how long each
+    file took from landing in the directory to being part of the version a dashboard would get.
+    '''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    os.environ['WATCH_UPLOADS'] = '1'
+
+    booted = time.monotonic()
+    import app
+    print('booted on {} files in {:.1f}s'.format(len(os.listdir(app.UPLOAD_DIRECTORY)), time.monotonic() - booted))
+
+    written = {}
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def poll():
+        # a dashboard gets the version published before its poll, the serials of the new files are looked up in it
+        version = None
+        while not done.wait(app.VERSION_POLL_INTERVAL / 1000):
+            if app.DATASETS.latest_version == version:
+                continue
+            version = app.DATASETS.latest_version
+            devices = app.DATASETS.dataset(version).devices
+            polled = time.monotonic()
+            with lock:
+                for serial in [x for x in written if x in devices]:
+                    latencies.append(polled - written.pop(serial))
+
+    poller = threading.Thread(target=poll, name='version-poll', daemon=True)
+    poller.start()
+
+    for i in range(int(rate * duration)):
+        serial = 'F099-{:05d}'.format(i % 100000)
+        text = clio_text(serial, pd.Timestamp.now().floor('s'))
+        with lock:
+            written[serial.lower()] = time.monotonic()
+        with open(os.path.join(app.UPLOAD_DIRECTORY, serial + '_new.txt'), 'w', newline='') as f:
+            f.write(text)
+        time.sleep(1.0 / rate)
+
+    # lets the last files through, the ones still missing are reported
+    deadline = time.monotonic() + 60
+    while written and time.monotonic() < deadline:
+        time.sleep(0.1)
+    done.set()
+    poller.join()
+
+    results.put((latencies, len(written)))
+
+
+def bench_watcher(rate, duration, backlog, seed=0):
+    '''
+    Latency of the ingestion of new files on the real path: a file lands in the upload directory (already holding
+    `backlog` files, parsed into the snapshot on boot), the directory watcher queues it, run_ingest_job() publishes a new
+    version with it (refresh_dataset()) and open dashboards see that version on their next poll.
+    '''
+    workdir = tempfile.mkdtemp()
+    write_clio_files(os.path.join(workdir, 'Data'), backlog, seed=seed)
+
+    # a fresh interpreter, the app reads its settings and boots when imported
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=watched_app, args=(workdir, rate, duration, results))
+    process.start()
+    latencies, missing = results.get()
+    process.join()
+    shutil.rmtree(workdir)
+
+    latencies = np.array(latencies)
+    print('watcher: {} files at {}/s over a backlog of {} files ({} not ingested)'.format(len(latencies), rate, backlog, missing))
+    if len(latencies):
+        print('latency [s]: p50 {:.2f}, p95 {:.2f}, max {:.2f}'.format(*np.percentile(latencies, [50, 95, 100])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the Orion dashboard data pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--rowwise-limit', type=int, default=1000000,
+                        help='largest size the (slow) row-wise reference is run on')
+    parser.add_argument('--suite', action='store_true', help='run the end-to-end suite on synthetic CLIO files instead')
+    parser.add_argument('--out', default=None, help='json file the results of --suite are written to')
+    parser.add_argument('--jobs', type=int, default=1, help='parser processes for --suite')
+    parser.add_argument('--archive', action='store_true', help='--suite reads the files from a zip archive')
+    parser.add_argument('--parser', action='store_true', help='time the fast-path parser instead')
+    parser.add_argument('--check-parser', action='store_true', help='check the fast-path parser against the repairing one on a fixed corpus instead')
+    parser.add_argument('--defect-rate', type=float, default=0.02, help='share of synthetic files with defects (--suite, --parser)')
+    parser.add_argument('--partitions', action='store_true', help='time pruned reads of the snapshot instead')
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 180, 720], help='history lengths for --partitions')
+    parser.add_argument('--memory', action='store_true', help='report the memory of the compact frame instead')
+    parser.add_argument('--shared', action='store_true', help='compare the memory of workers sharing the dataset instead')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts for --shared')
+    parser.add_argument('--watcher', action='store_true', help='measure the latency of new files from the directory to the dashboards instead')
+    parser.add_argument('--rate', type=float, default=10, help='files per second written for --watcher')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of writing for --watcher')
+    parser.add_argument('--backlog', type=int, default=10000, help='files already in the directory for --watcher')
+    args = parser.parse_args()
+
+    if args.shared:
+        bench_shared(args.sizes[-1], args.workers)
+
+    elif args.watcher:
+        bench_watcher(args.rate, args.duration, args.backlog)
+
+    elif args.suite:
+        bench_suite(args.sizes, args.out, args.jobs, defect_rate=args.defect_rate, archive=args.archive)
+
+    elif args.check_parser:
+        check_parser()
+
+    elif args.parser:
+        bench_parser(args.sizes, args.defect_rate)
+
+    elif args.partitions:
+        bench_partitions(args.days)
+
+    elif args.memory:
+        bench_memory(args.sizes)
+
+    else:
+        bench_state(args.sizes, args.rowwise_limit)
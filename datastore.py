@@ -0,0 +1,623 @@
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import aux_methods as aux
+
+
+# ---------------------- DAILY ROLLUP -------------------------- #
+class DailyRollup:
+    '''
+    Pre-aggregated counts per day: devices per state (day x state) and failed sub-tests (day x sub-test).
+    Rollups are never modified, add() returns a new one, so they can be shared between callbacks.
+    '''
+    def __init__(self, states: pd.DataFrame, subtests: pd.DataFrame):
+        self.states = states
+        self.subtests = subtests
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        '''
+        Builds the rollup of a frame indexed by 'created_at'
+        '''
+        return cls(aux.daily_state_counts(df), aux.daily_subtest_failures(df))
+
+    @classmethod
+    def from_partitions(cls, meta: dict):
+        '''
+        Builds the rollup from the partition manifest of a snapshot (see aux.load_snapshot_meta()), without reading any rows
+        '''
+        partitions = [x for x in meta['partitions'].values() if x['day'] != 'unknown']
+        if not partitions:
+            return cls(pd.DataFrame(index=pd.DatetimeIndex([])), pd.DataFrame(index=pd.DatetimeIndex([]), columns=aux.SUBTESTS))
+
+        days = pd.DatetimeIndex([x['day'] for x in partitions], name='created_at')
+
+        # partitions of different model series on the same day are summed up
+        states = pd.DataFrame([x['states'] for x in partitions], index=days).fillna(0).astype(int).groupby(level=0).sum()
+        states = states.loc[:, (states > 0).any()]
+        states.columns.name = 'state'
+
+        subtests = pd.DataFrame([x['failed'] for x in partitions], index=days, columns=aux.SUBTESTS).fillna(0).astype(int)
+
+        return cls(states[aux.sort_states(states.columns)], subtests.groupby(level=0).sum())
+
+    def add(self, df: pd.DataFrame):
+        '''
+        Returns the rollup with the rows of df (indexed by 'created_at') added, in O(days) plus the size of df
+        '''
+        other = DailyRollup.from_frame(df)
+
+        states = self.states.add(other.states, fill_value=0).fillna(0).astype(int)
+        subtests = self.subtests.add(other.subtests, fill_value=0).fillna(0).astype(int)
+
+        return DailyRollup(states[aux.sort_states(states.columns)], subtests)
+
+    def window(self, start, end) -> pd.DataFrame:
+        '''
+        (day x state) counts from the start date to the end date (both included)
+        '''
+        return self.states.loc[pd.Timestamp(start).normalize() : pd.Timestamp(end).normalize()]
+
+    def subtest_window(self, start, end) -> pd.DataFrame:
+        '''
+        (day x sub-test) failure counts from the start date to the end date (both included)
+        '''
+        return self.subtests.loc[pd.Timestamp(start).normalize() : pd.Timestamp(end).normalize()]
+
+    @property
+    def first_day(self):
+        return self.states.index.min()
+
+    @property
+    def last_day(self):
+        return self.states.index.max()
+
+
+# ---------------------- DEVICE INDEX -------------------------- #
+class DeviceIndex:
+    '''
+    Device serial -> positions (in the published frame) of every test run of that device, over two arrays so it can be
+    memory-mapped: order[offsets[i]:offsets[i + 1]] are the positions of the test runs of the device serials[i].
+    serials is an Index, or the sorted array of utf-8 bytes of a shared dataset (see write_dataset()).
+    Like rollups, indexes are never modified, extend() returns a new one.
+    '''
+    EMPTY = np.empty(0, dtype=np.intp)
+
+    def __init__(self, serials: pd.Index, order: np.ndarray, offsets: np.ndarray):
+        self._serials = serials
+        self._order = order
+        self._offsets = offsets
+
+    @classmethod
+    def from_codes(cls, serials: pd.Index, codes: np.ndarray, offset: int = 0):
+        '''
+        Builds the index from the codes of the 'id' categorical of a frame (serials being its categories), positions start at offset
+        '''
+        # a stable sort keeps the runs of each device in the order of the frame
+        order = np.argsort(codes, kind='mergesort')
+        offsets = np.searchsorted(codes[order], np.arange(len(serials) + 1))
+
+        return cls(serials, order + offset if offset else order, offsets)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, offset: int = 0):
+        '''
+        Builds the index of a frame, positions start at offset
+        '''
+        if hasattr(df['id'], 'cat'):
+            return cls.from_codes(df['id'].cat.categories, df['id'].cat.codes.values, offset)
+
+        codes, serials = pd.factorize(df['id'].values)
+        return cls.from_codes(pd.Index(serials), codes, offset)
+
+    def extend(self, df: pd.DataFrame, offset: int):
+        '''
+        Returns the index with the rows of df added, df being the rows of the frame from position offset on
+        '''
+        added = DeviceIndex.from_frame(df, offset)
+        serials = self._serials.append(added._serials[self._serials.get_indexer(added._serials) < 0])
+
+        # the positions of both indexes, keyed by their serial in serials (the rows of df come after, so they stay sorted)
+        keys = np.concatenate([
+            np.repeat(np.arange(len(self._serials)), np.diff(self._offsets)),
+            np.repeat(serials.get_indexer(added._serials), np.diff(added._offsets)),
+        ])
+        positions = np.concatenate([self._order[self._offsets[0]:], added._order[added._offsets[0]:]])
+
+        order = np.argsort(keys, kind='mergesort')
+        return DeviceIndex(serials, positions[order], np.searchsorted(keys[order], np.arange(len(serials) + 1)))
+
+    def positions(self, ids) -> np.ndarray:
+        '''
+        Sorted positions of the test runs of the devices in ids (unknown serials are ignored)
+        '''
+        found = [self._order[self._offsets[i]:self._offsets[i + 1]] for i in self._indexer(ids) if i >= 0]
+        if not found:
+            return DeviceIndex.EMPTY
+
+        return found[0] if len(found) == 1 else np.sort(np.concatenate(found))
+
+    def _indexer(self, ids) -> np.ndarray:
+        '''
+        Position of each of ids in serials, -1 if it is not there
+        '''
+        if isinstance(self._serials, pd.Index):
+            return self._serials.get_indexer(ids)
+
+        # looked up by binary search, the serials are never turned into strings
+        keys = np.array([str(x).encode('utf-8') for x in ids], dtype=np.bytes_)
+        if not len(self._serials):
+            return np.full(len(keys), -1, dtype=np.intp)
+
+        i = np.searchsorted(self._serials, keys)
+        return np.where(self._serials[np.minimum(i, len(self._serials) - 1)] == keys, i, -1)
+
+    def __contains__(self, serial):
+        i = self._indexer([serial])[0]
+        return i >= 0 and self._offsets[i + 1] > self._offsets[i]
+
+    def __len__(self):
+        # categories without a test run in the frame are not devices of it
+        return int(np.count_nonzero(np.diff(self._offsets)))
+
+
+# ---------------------- SERVER-SIDE DATASET REGISTRY -------------------------- #
+class Dataset:
+    '''
+    A published version of the data: the frame (indexed by 'created_at' and sorted), its daily rollup and its device index.
+    If only the recent history is kept in memory, since is its first day (the rollup still covers the whole history).
+    With serials (a shared dataset, see read_dataset()) the 'id' column of the frame holds their codes, the rows handed
+    out by rows(), window() and appended_since() get the serials back.
+    '''
+    def __init__(self, version: str, frame: pd.DataFrame, rollup: DailyRollup, devices: DeviceIndex = None, since=None, serials=None):
+        self.version = version
+        self.frame = frame
+        self.rollup = rollup
+        self._devices = devices
+        self.since = since
+        self.serials = serials
+
+    @property
+    def devices(self):
+        # built on first use, windows read from the snapshot are often only queried by date
+        if self._devices is None:
+            self._devices = DeviceIndex.from_frame(self.frame)
+
+        return self._devices
+
+    def covers(self, start) -> bool:
+        '''
+        True if the rows tested from start on are all in the frame
+        '''
+        return self.since is None or pd.Timestamp(start) >= self.since
+
+    def rows(self, ids) -> pd.DataFrame:
+        '''
+        Every test run of the devices in ids, in the order of the frame
+        '''
+        return self._decode(self.frame.iloc[self.devices.positions(ids)])
+
+    def window(self, start=None, end=None, states=None, ids=None) -> pd.DataFrame:
+        '''
+        Rows tested from start up to end (excluded), in the states and of the devices given (empty means all), see aux.window_rows().
+        The devices are looked up in the device index and their positions cut to the window by binary search.
+        '''
+        if not ids:
+            return self._decode(aux.window_rows(self.frame, start, end, states))
+
+        positions = self.devices.positions(ids)
+        i, j = aux.window_bounds(self.frame.index.values, start, end)
+        positions = positions[np.searchsorted(positions, i):np.searchsorted(positions, j)]
+
+        return self._decode(aux.window_rows(self.frame.iloc[positions], states=states))
+
+    def appended_since(self, other):
+        '''
+        Rows appended to the frame of other (an earlier version) to give this one, i.e. the rows tested after its last row.
+        None unless this frame is other's with rows added at its end (e.g. files with older results were ingested).
+        '''
+        if other.since != self.since or len(other.frame) > len(self.frame):
+            return None
+
+        # as many rows up to the last one of other as other has, the rest was tested after it
+        offset = len(other.frame)
+        if offset and np.searchsorted(self.frame.index.values, other.frame.index.values[-1], side='right') != offset:
+            return None
+
+        return self._decode(self.frame.iloc[offset:])
+
+    def _decode(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        df (rows of the frame) with the serials of their codes, only those rows are turned into strings
+        '''
+        if self.serials is None:
+            return df
+
+        codes = df['id'].values
+        ids = np.char.decode(self.serials[codes], 'utf-8').astype(object)
+        ids[codes < 0] = np.nan
+
+        return with_ids(df, ids)
+
+
+class DatasetStore:
+    '''
+    Keeps the parsed dataframe on the server, so the browser only carries a small version token.
+    Frames are stored compact (see aux.to_compact()), indexed by 'created_at' and sorted, ready to be used by the auxiliary
+    methods in aux_methods.py. Rows sent to the browser go through aux.from_compact() first.
+    The frames handed out are shared between callbacks and must not be modified in place.
+    '''
+    # a store held by a single process publishes its own datasets (see SharedDatasetStore)
+    is_loader = True
+
+    def __init__(self, keep=4):
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        # a few older versions are kept around for clients that have not picked up the latest token yet
+        self._keep = keep
+        self._versions = OrderedDict()
+
+    def publish(self, df: pd.DataFrame, rollup: DailyRollup = None, since=None) -> str:
+        '''
+        Indexes and sorts the frame once and registers it under a new version token.
+        A frame holding only the history from day `since` on comes with the rollup of the whole history.
+        '''
+        df = aux.to_compact(df.set_index('created_at'))
+        df.sort_index(kind='mergesort', inplace=True)
+
+        if rollup is None:
+            rollup = DailyRollup.from_frame(df)
+
+        return self._register(df, rollup, DeviceIndex.from_frame(df), since)
+
+    def append(self, rows: pd.DataFrame, rollup: DailyRollup = None, since=None) -> str:
+        '''
+        Publishes the latest frame plus rows (a frame like the ones publish() takes) without going over the rows it already has:
+        only rows are made compact and sorted, and the rollup is updated with them, as is the device index when they were all
+        tested after the latest frame (they sort to its end, otherwise the frame is sorted again). With since, the rows tested
+        before that day are dropped from the frame, the rollup (rollup if given) still counts them.
+        '''
+        latest = self.dataset()
+        rows = aux.to_compact(rows.set_index('created_at'))
+        rows.sort_index(kind='mergesort', inplace=True)
+
+        offset = len(latest.frame)
+        df = aux.concat_frames([latest.frame, rows])
+        devices = None
+
+        if not len(rows) or not offset or rows.index[0] >= latest.frame.index[-1]:
+            devices = latest.devices.extend(df.iloc[offset:], offset)
+        else:
+            df.sort_index(kind='mergesort', inplace=True)
+
+        if rollup is None:
+            rollup = latest.rollup.add(rows)
+
+        if since is not None:
+            first = int(np.searchsorted(df.index.values, pd.Timestamp(since).to_datetime64()))
+            if first:
+                df, devices = df.iloc[first:], None
+
+        return self._register(df, rollup, devices if devices is not None else DeviceIndex.from_frame(df), since)
+
+    def _register(self, df: pd.DataFrame, rollup: DailyRollup, devices: DeviceIndex, since=None) -> str:
+        '''
+        '''
+        with self._lock:
+            version = str(next(self._counter))
+            self._versions[version] = Dataset(version, df, rollup, devices, None if since is None else pd.Timestamp(since))
+
+            while len(self._versions) > self._keep:
+                self._versions.popitem(last=False)
+
+        return version
+
+    def dataset(self, version=None) -> Dataset:
+        '''
+        Returns the dataset registered under version, or the latest one if the version is unknown (e.g. after a restart).
+        None if nothing has been published yet.
+        '''
+        with self._lock:
+            if not self._versions:
+                return None
+
+            if version in self._versions:
+                return self._versions[version]
+
+            return next(reversed(self._versions.values()))
+
+    def held(self, version) -> Dataset:
+        '''
+        The dataset registered under version, None if it is unknown or no longer kept
+        '''
+        with self._lock:
+            return self._versions.get(version)
+
+    def get(self, version=None) -> pd.DataFrame:
+        '''
+        Returns the frame registered under version (see dataset())
+        '''
+        dataset = self.dataset(version)
+        if dataset is None:
+            raise KeyError('No dataset has been published yet')
+
+        return dataset.frame
+
+    def rollup(self, version=None) -> DailyRollup:
+        '''
+        Returns the daily rollup of the frame registered under version (see dataset())
+        '''
+        dataset = self.dataset(version)
+        if dataset is None:
+            raise KeyError('No dataset has been published yet')
+
+        return dataset.rollup
+
+    @property
+    def latest_version(self):
+        with self._lock:
+            return next(reversed(self._versions), None)
+
+
+# ---------------------- SHARED DATASETS -------------------------- #
+def write_dataset(dataset: Dataset, directory):
+    '''
+    Writes a dataset to directory as files that can be memory-mapped: the columns of the frame (see aux.write_snapshot_segment()),
+    its serials (sorted, as fixed-width utf-8 bytes) with 'id' holding their codes, the arrays of its device index, and its rollup
+    '''
+    frame = dataset.frame.reset_index()
+    ids = frame['id'].astype('category')
+    ids = ids.cat.reorder_categories(ids.cat.categories.sort_values())
+
+    frame['id'] = ids.cat.codes.values.astype(np.int32)
+    aux.write_snapshot_segment(frame, directory)
+    np.save(os.path.join(directory, 'serials.npy'), np.array([x.encode('utf-8') for x in ids.cat.categories], dtype=np.bytes_))
+
+    devices = DeviceIndex.from_codes(ids.cat.categories, frame['id'].values)
+    np.save(os.path.join(directory, 'devices_order.npy'), devices._order)
+    np.save(os.path.join(directory, 'devices_offsets.npy'), devices._offsets)
+
+    pd.to_pickle((dataset.rollup.states, dataset.rollup.subtests), os.path.join(directory, 'rollup.pkl'))
+
+    with open(os.path.join(directory, 'dataset.json'), 'w') as f:
+        json.dump(dict(version=dataset.version, since=None if dataset.since is None else dataset.since.isoformat()), f)
+
+def read_dataset(directory) -> Dataset:
+    '''
+    Attaches to a dataset written by write_dataset(): the frame, its serials and the device index are views of the
+    memory-mapped files, only the categories of the other columns (a few states and results) and the rollup are read into memory
+    '''
+    with open(os.path.join(directory, 'dataset.json'), 'r') as f:
+        meta = json.load(f)
+
+    data = aux.read_snapshot_segment(directory, mmap=True)
+    index = pd.DatetimeIndex(data.pop('created_at'), name='created_at')
+    frame = pd.DataFrame(data, index=index, copy=False)
+
+    serials = np.load(os.path.join(directory, 'serials.npy'), mmap_mode='r')
+    devices = DeviceIndex(
+        serials,
+        np.load(os.path.join(directory, 'devices_order.npy'), mmap_mode='r'),
+        np.load(os.path.join(directory, 'devices_offsets.npy'), mmap_mode='r'),
+    )
+    rollup = DailyRollup(*pd.read_pickle(os.path.join(directory, 'rollup.pkl')))
+
+    return Dataset(meta['version'], frame, rollup, devices, None if meta['since'] is None else pd.Timestamp(meta['since']), serials)
+
+def with_ids(frame: pd.DataFrame, ids) -> pd.DataFrame:
+    '''
+    frame with its 'id' column replaced by ids, the other columns are not copied (frame.assign() would copy them all)
+    '''
+    data = OrderedDict((column, ids if column == 'id' else frame[column].values) for column in frame.columns)
+    return pd.DataFrame(data, index=frame.index, copy=False)
+
+
+class SharedDatasetStore(DatasetStore):
+    '''
+    DatasetStore shared by the worker processes of a pre-fork server (e.g. gunicorn). Only one process, the loader, publishes:
+    every version is written to path/<version>/ (see write_dataset()) and path/CURRENT is then pointed to it.
+    The other processes attach to the version CURRENT points to the next time they are asked for a dataset, so the rows
+    are held once, in the page cache, whatever the number of workers. The loader is elected with a lock (see elect_loader()).
+    '''
+    POINTER = 'CURRENT'
+
+    def __init__(self, path, keep=4):
+        super().__init__(keep)
+        self.path = path
+        self.is_loader = False
+        self._lock_file = None
+        self._attach_lock = threading.Lock()
+        self._pointer_stat = None
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def acquire_loader_lock(self):
+        '''
+        Blocks until this process holds the exclusive lock on path/loader.lock, then makes it the loader.
+        The lock is released when the process exits, so another worker takes over if the loader goes away.
+        '''
+        # flock() is only available on Unix, where pre-fork servers run
+        import fcntl
+
+        lock_file = open(os.path.join(self.path, 'loader.lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        with self._lock:
+            self._lock_file = lock_file
+            # versions go on from the last one published, whoever the previous loader was
+            self._counter = itertools.count(int(self._read_pointer() or 0) + 1)
+            self.is_loader = True
+
+    def elect_loader(self, on_elected):
+        '''
+        Waits for the loader lock in a background thread (see acquire_loader_lock()) and calls on_elected() once this
+        process is the loader, so no worker waits for the dataset to be loaded before serving
+        '''
+        def wait_for_lock():
+            self.acquire_loader_lock()
+            print('SHARED_DATASET: process {} is the loader'.format(os.getpid()))
+            on_elected()
+
+        threading.Thread(target=wait_for_lock, name='loader-election', daemon=True).start()
+
+    def _register(self, df: pd.DataFrame, rollup: DailyRollup, devices: DeviceIndex, since=None) -> str:
+        '''
+        Registers like DatasetStore (see publish() and append()), writes the new version to path/<version>/ and points CURRENT to it.
+        The loader then serves the memory-mapped frame as well, its private copy is dropped.
+        '''
+        if not self.is_loader:
+            raise RuntimeError('only the loader process publishes datasets')
+
+        version = super()._register(df, rollup, devices, since)
+        dataset = super().dataset(version)
+
+        # the directory only gets its name once complete, CURRENT never points to a partial version
+        directory = os.path.join(self.path, version)
+        staging = directory + '.tmp'
+        for leftover in [staging, directory]:
+            shutil.rmtree(leftover, ignore_errors=True)
+
+        write_dataset(dataset, staging)
+        os.rename(staging, directory)
+
+        # the rollup and device index of the loader are kept, they are updated incrementally by the next publish,
+        # and so is the frame's 'id' categorical (the loader appends to it, see append())
+        shared = read_dataset(directory)
+        serials = pd.Index(np.char.decode(shared.serials, 'utf-8').astype(object))
+        frame = with_ids(shared.frame, pd.Categorical.from_codes(shared.frame['id'].values, serials))
+        with self._lock:
+            if version in self._versions:
+                self._versions[version] = Dataset(version, frame, dataset.rollup, dataset.devices, dataset.since)
+
+        self._write_pointer(version)
+        self._remove_old_versions()
+
+        return version
+
+    def dataset(self, version=None) -> Dataset:
+        '''
+        See DatasetStore.dataset(), workers attach to the latest version first if CURRENT changed
+        '''
+        if not self.is_loader:
+            self._attach_latest()
+
+        return super().dataset(version)
+
+    @property
+    def latest_version(self):
+        if not self.is_loader:
+            self._attach_latest()
+
+        with self._lock:
+            return next(reversed(self._versions), None)
+
+    def _attach_latest(self):
+        try:
+            stat = os.stat(os.path.join(self.path, self.POINTER))
+        except OSError:
+            return
+
+        # CURRENT is replaced (new inode) on every publish, a stat is enough to tell whether it moved
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._pointer_stat:
+            return
+
+        with self._attach_lock:
+            if key == self._pointer_stat:
+                return
+
+            version = self._read_pointer()
+            try:
+                dataset = read_dataset(os.path.join(self.path, version))
+
+            except (IOError, ValueError) as e:
+                print('SHARED_DATASET_WARNING: could not attach to version {},'.format(version), e)
+                return
+
+            with self._lock:
+                self._versions[version] = dataset
+                while len(self._versions) > self._keep:
+                    self._versions.popitem(last=False)
+
+            self._pointer_stat = key
+
+    def _read_pointer(self):
+        try:
+            with open(os.path.join(self.path, self.POINTER), 'r') as f:
+                return f.read().strip() or None
+
+        except IOError:
+            return None
+
+    def _write_pointer(self, version):
+        staging = os.path.join(self.path, self.POINTER + '.tmp')
+        with open(staging, 'w') as f:
+            f.write(version)
+
+        os.replace(staging, os.path.join(self.path, self.POINTER))
+
+    def _remove_old_versions(self):
+        # workers still holding an old version keep reading it, the files of a mapping outlive their directory entry
+        versions = sorted((int(x) for x in os.listdir(self.path) if x.isdigit()), reverse=True)
+        for version in versions[self._keep:]:
+            shutil.rmtree(os.path.join(self.path, str(version)), ignore_errors=True)
+
+
+# ---------------------- FIGURE CACHE -------------------------- #
+class FigureCache:
+    '''
+    Bounded, thread-safe memoization of figures keyed on the dataset version plus the normalized callback parameters.
+    Least recently used entries are evicted beyond max_size entries, and entries older than max_age seconds are rebuilt.
+    Cached figures are shared between requests and must not be modified.
+    '''
+    def __init__(self, max_size=256, max_age=900):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, build):
+        '''
+        Returns the figure cached under key, calling build() to make it on a miss
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and now - entry[0] <= self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        # built outside the lock, so a slow figure doesn't hold back the cached ones
+        figure = build()
+
+        with self._lock:
+            self._entries[key] = (now, figure)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return figure
+
+    def stats(self):
+        '''
+        '''
+        with self._lock:
+            return dict(size=len(self._entries), hits=self.hits, misses=self.misses, evictions=self.evictions)
@@ -0,0 +1,335 @@
+import ctypes
+import ctypes.util
+import itertools
+import json
+import os
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+# ---------------------- DIRECTORY WATCHER -------------------------- #
+
+# inotify flags (see inotify(7)), only the events that mean a file is complete, renamed or removed
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    '''
+    Minimal inotify binding through ctypes, raises OSError where inotify is not available
+    '''
+    def __init__(self, path):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def read(self, timeout):
+        '''
+        Waits up to timeout seconds and returns the names of the files that changed
+        '''
+        names = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return names
+
+        offset = 0
+        while offset < len(buf):
+            _, _, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            names.add(buf[offset:offset + length].rstrip(b'\0').decode('utf8', 'replace'))
+            offset += length
+
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    '''
+    Fallback for platforms without inotify: compares the (size, mtime) of the files in the directory
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.listing = self.scan()
+
+    def scan(self):
+        listing = {}
+        for entry in os.scandir(self.path):
+            if entry.is_file():
+                stat = entry.stat()
+                listing[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+        return listing
+
+    def read(self, timeout):
+        time.sleep(timeout)
+
+        listing = self.scan()
+        names = set(x for x in set(listing) | set(self.listing) if listing.get(x) != self.listing.get(x))
+        self.listing = listing
+
+        return names
+
+    def close(self):
+        pass
+
+
+class DirectoryWatcher(threading.Thread):
+    '''
+    Background thread that calls on_change(names) when files land in (or leave) path.
+    Bursts of events are debounced: on_change runs once events stop for `debounce` seconds, or at the latest
+    `max_delay` seconds after the first pending event, so a sustained stream of files is still ingested regularly.
+    '''
+    def __init__(self, path, on_change, debounce=0.5, max_delay=2.0, poll_interval=1.0, use_inotify=True):
+        super().__init__(name='directory-watcher', daemon=True)
+        self.path = path
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = Inotify(path)
+            except OSError as e:
+                print('WATCHER_WARNING: falling back to polling,', e)
+
+        if self.source is None:
+            self.source = Poller(path)
+
+    def run(self):
+        pending = set()
+        first_event = last_event = None
+
+        while not self._stop_event.is_set():
+            timeout = self.debounce / 2 if pending else self.poll_interval
+            names = self.source.read(timeout)
+            now = time.monotonic()
+
+            if names:
+                pending |= names
+                last_event = now
+                first_event = first_event or now
+
+            if pending and (now - last_event >= self.debounce or now - first_event >= self.max_delay):
+                names, pending = pending, set()
+                first_event = last_event = None
+
+                try:
+                    self.on_change(names)
+                except Exception as e:
+                    print('WATCHER_ERROR:', e)
+
+        self.source.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# ---------------------- INGESTION JOBS -------------------------- #
+class IngestJob:
+    '''
+    A batch of files to ingest, with the count of files parsed (well-formed), repaired and rejected so far.
+    status goes from 'queued' to 'running' and then 'done' (version is the dataset it published) or 'failed'.
+    Jobs of a spooled queue are saved to path on every change (see IngestQueue).
+    '''
+    def __init__(self, job_id, files, source, path=None):
+        self.id = job_id
+        self.path = path
+        self.files = list(files)
+        self.source = source
+        self.status = 'queued'
+        self.parsed = self.repaired = self.rejected = 0
+        self.version = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = self.finished = None
+
+    def report(self, outcomes):
+        '''
+        Progress callback for the parser (see aux.parse_files()), outcomes is the running count of each outcome
+        '''
+        self.parsed = outcomes.get('parsed', 0)
+        self.repaired = outcomes.get('repaired', 0)
+        self.rejected = outcomes.get('rejected', 0)
+        self.save()
+
+    def save(self):
+        '''
+        '''
+        if self.path is None:
+            return
+
+        staging = self.path + '.tmp'
+        with open(staging, 'w') as f:
+            json.dump(dict(self.to_dict(), files=self.files), f)
+
+        os.replace(staging, self.path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        '''
+        with open(path, 'r') as f:
+            state = json.load(f)
+
+        job = cls(state.pop('id'), state.pop('files'), state.pop('source'), path)
+        job.__dict__.update(state)
+
+        return job
+
+    def to_dict(self):
+        return dict(id=self.id, status=self.status, source=self.source, files=len(self.files), parsed=self.parsed,
+                    repaired=self.repaired, rejected=self.rejected, version=self.version, error=self.error,
+                    submitted=self.submitted, started=self.started, finished=self.finished)
+
+
+class IngestQueue(threading.Thread):
+    '''
+    Background thread running ingestion jobs one at a time, so uploads return a job id at once instead of waiting for the parser.
+    run_job(job) does the work and returns the version it published. Files submitted while a job is still queued are
+    added to it, so a burst of uploads is ingested in one go. The last `keep` jobs are kept for progress queries.
+    With a spool directory, jobs are kept there as json files instead, so processes that don't run the queue (e.g. the
+    other workers of a pre-fork server) can submit jobs and follow them too. Spooled jobs are not merged.
+    '''
+    def __init__(self, run_job, keep=100, spool=None):
+        super().__init__(name='ingest-queue', daemon=True)
+        self.run_job = run_job
+        self.keep = keep
+        self.spool = spool
+        self._counter = itertools.count(1)
+        self._jobs = OrderedDict()
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+
+        if spool is not None and not os.path.exists(spool):
+            os.makedirs(spool)
+
+    def submit(self, files, source='upload'):
+        '''
+        Queues the files for ingestion and returns the id of the job they belong to
+        '''
+        if self.spool is not None:
+            # ids sort in submission order, whichever process submitted them
+            job_id = '{:013d}-{}-{}'.format(int(time.time() * 1000), os.getpid(), next(self._counter))
+            job = IngestJob(job_id, files, source, os.path.join(self.spool, job_id + '.json'))
+            job.save()
+
+            with self._condition:
+                self._condition.notify()
+
+            return job.id
+
+        with self._condition:
+            if self._queue:
+                job = self._queue[-1]
+                job.files.extend([x for x in files if x not in job.files])
+                return job.id
+
+            job = IngestJob(str(next(self._counter)), files, source)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+
+            while len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+
+            self._condition.notify()
+            return job.id
+
+    def job(self, job_id):
+        '''
+        The job registered under job_id, None if it is unknown (or too old)
+        '''
+        if self.spool is not None:
+            try:
+                return IngestJob.load(os.path.join(self.spool, os.path.basename(job_id) + '.json'))
+            except (IOError, ValueError, KeyError):
+                return None
+
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def spooled_jobs(self):
+        '''
+        Jobs of the spool directory still queued, in submission order
+        '''
+        jobs = []
+        for fname in sorted(os.listdir(self.spool)):
+            if fname.endswith('.json'):
+                job = self.job(fname[:-len('.json')])
+                if job is not None and job.status == 'queued':
+                    jobs.append(job)
+
+        return jobs
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                if not self._queue and self.spool is not None:
+                    self._queue.extend(self.spooled_jobs())
+
+                if not self._queue:
+                    self._condition.wait(timeout=1.0)
+                    continue
+
+                job = self._queue.popleft()
+                job.status, job.started = 'running', time.time()
+
+            job.save()
+            try:
+                job.version = self.run_job(job)
+                job.status = 'done'
+
+            except Exception as e:
+                print('INGEST_ERROR: job {},'.format(job.id), e)
+                job.status, job.error = 'failed', str(e)
+
+            job.finished = time.time()
+            job.save()
+
+            if self.spool is not None:
+                self.remove_old_jobs()
+
+    def remove_old_jobs(self):
+        '''
+        '''
+        fnames = sorted(x for x in os.listdir(self.spool) if x.endswith('.json'))
+        for fname in fnames[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.spool, fname))
+            except OSError:
+                pass
+
+    def stop(self):
+        with self._condition:
+            self._stop_event.set()
+            self._condition.notify()
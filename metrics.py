@@ -0,0 +1,209 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ---------------------- METRICS REGISTRY -------------------------- #
+
+# upper bounds of the histogram buckets (seconds, rows and bytes)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTES_BUCKETS = (1 << 10, 1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24)
+
+# callbacks slower than this many seconds are logged with their inputs (set SLOW_CALLBACK_SECONDS=0 to turn it off)
+SLOW_CALLBACK_SECONDS = float(os.environ.get('SLOW_CALLBACK_SECONDS', 1.0))
+
+
+def format_labels(names, values, **extra):
+    '''
+    '''
+    pairs = list(zip(names, values)) + sorted(extra.items())
+    if not pairs:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Histogram:
+    '''
+    Prometheus-style histogram (cumulative buckets, sum and count) for each combination of label values
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        '''
+        '''
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        '''
+        '''
+        with self._lock:
+            series = {k: ([x for x in v[0]], v[1], v[2]) for k, v in self._series.items()}
+
+        lines = []
+        for label_values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labels, label_values, le=bound), cumulative))
+
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, label_values), total))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, label_values), count))
+
+        return lines
+
+
+class Counter:
+    '''
+    Monotonic counter for each combination of label values
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            series = dict(self._series)
+
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, k), v) for k, v in sorted(series.items())]
+
+
+class Gauge:
+    '''
+    Values read when the metrics are scraped, read() returns a {label values: value} dict
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.read = read
+
+    def render(self):
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, k), v) for k, v in sorted(self.read().items())]
+
+
+class Registry:
+    '''
+    '''
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''
+        All metrics in the Prometheus text exposition format (version 0.0.4)
+        '''
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram('orion_stage_seconds', 'Time spent in each stage of the data pipeline', ('stage',)))
+STAGE_ROWS = REGISTRY.register(Histogram('orion_stage_rows', 'Rows handled by each stage of the data pipeline', ('stage',), ROWS_BUCKETS))
+CALLBACK_SECONDS = REGISTRY.register(Histogram('orion_callback_seconds', 'Time spent in each Dash callback', ('callback',)))
+CALLBACK_CALLS = REGISTRY.register(Counter('orion_callback_calls_total', 'Dash callback calls by outcome', ('callback', 'outcome')))
+RESPONSE_BYTES = REGISTRY.register(Histogram('orion_response_bytes', 'Size of the responses sent to the browser', ('route',), BYTES_BUCKETS))
+
+
+# ---------------------- TIMING HOOKS -------------------------- #
+@contextmanager
+def timed_stage(stage, rows=None):
+    '''
+    Times the block as a stage of the data pipeline. The number of rows can be given up front or set on the yielded
+    dict (e.g. stage['rows'] = len(df)) once known.
+    '''
+    info = dict(rows=rows)
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+        if info['rows'] is not None:
+            STAGE_ROWS.observe(info['rows'], stage)
+
+
+def timed_callback(name, slow=None):
+    '''
+    Decorator for Dash callbacks: records the latency and outcome ('ok', 'prevented' or 'error') of each call,
+    and logs calls slower than `slow` seconds (SLOW_CALLBACK_SECONDS by default) with their inputs
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outcome = 'ok'
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+
+            except Exception as e:
+                # dash.exceptions.PreventUpdate is how callbacks say there is nothing to do
+                outcome = 'prevented' if type(e).__name__ == 'PreventUpdate' else 'error'
+                raise
+
+            finally:
+                elapsed = time.perf_counter() - start
+                CALLBACK_SECONDS.observe(elapsed, name)
+                CALLBACK_CALLS.inc(name, outcome)
+
+                threshold = SLOW_CALLBACK_SECONDS if slow is None else slow
+                if threshold and elapsed > threshold:
+                    print('SLOW_CALLBACK: {} took {:.3f}s, inputs: {}'.format(name, elapsed, truncated_repr(args)[:500]))
+
+        return wrapper
+
+    return decorator
+
+
+def truncated_repr(args, max_items=10):
+    '''
+    repr of the callback inputs, long lists (e.g. uploaded file contents) cut to their first items
+    '''
+    def short(x):
+        if isinstance(x, (list, tuple)) and len(x) > max_items:
+            return '{}... ({} items)'.format(repr(list(x[:max_items]))[:-1], len(x))
+
+        if isinstance(x, str) and len(x) > 200:
+            return repr(x[:200] + '...')
+
+        return repr(x)
+
+    return '(' + ', '.join(short(x) for x in args) + ')'
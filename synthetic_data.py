@@ -0,0 +1,132 @@
+import argparse
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import aux_methods as aux
+
+
+# ---------------------- SYNTHETIC CLIO RESULTS -------------------------- #
+
+# defects found in real CLIO exports, all of them are repaired by parse_test_results() or parse_timestamp_series()
+DEFECTS = [
+    'missing_subtest',      # one to three sub-test lines are missing
+    'missing_unit',         # the 'UNIT N.' line is missing, the serial comes from the file name
+    'swapped_date',         # month.day.year instead of day.month.year
+    'swapped_date_both',    # month.day.year with both numbers > 12 only after the swap can't be told apart (e.g. 13.14.2018)
+    'us_timestamp',         # '8-23-2018 10.44.40 AM', never parsed, the timestamp is taken from a neighbor
+    'truncated_timestamp',  # the time of day is missing
+]
+
+LINE_NAMES = ['Response', 'Polarity', 'RUB+BUZZ', 'THD']
+
+def generate_results(n_files, seed=0, start='2018-09-01', days=60, fail_rate=0.03, retest_rate=0.5, series=('F072', 'F090')):
+    '''
+    Ground truth for n_files test runs: one row per file with its name, serial, timestamp and sub-test results.
+    Serials are numbered in production order, and a share (retest_rate) of the failed devices is tested again later on.
+    '''
+    rng = np.random.RandomState(seed)
+
+    # production runs over working hours (7h to 18h) of `days` days, in order
+    offsets = np.sort(rng.randint(0, days, n_files)) * 86400 + rng.randint(7 * 3600, 18 * 3600, n_files)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(np.sort(offsets), unit='s')
+
+    failed = rng.rand(n_files, len(aux.SUBTESTS)) < fail_rate
+    results = pd.DataFrame(np.where(failed, 'bad', 'good'), columns=aux.SUBTESTS)
+    results['overall'] = np.where(failed.any(axis=1), 'bad', 'good')
+
+    # the serials of a series go up with time, a retest reuses the serial of an earlier failed run
+    serial_no = np.arange(n_files)
+    retests = np.flatnonzero(failed.any(axis=1)[:-1] & (rng.rand(n_files - 1) < retest_rate))
+    targets = np.minimum(retests + 1 + rng.randint(0, 50, len(retests)), n_files - 1)
+    serial_no[targets] = serial_no[retests]
+
+    prefixes = np.array(series)[serial_no % len(series)]
+    results['serial'] = ['{}-{:05d}'.format(prefix, x // len(series) % 100000) for prefix, x in zip(prefixes, serial_no)]
+    results['created_at'] = timestamps
+    results['fname'] = ['{}_{:07d}.txt'.format(serial, x) for serial, x in zip(results.serial, range(n_files))]
+
+    return results[['fname', 'serial', 'created_at'] + aux.SUBTESTS + ['overall']]
+
+def format_timestamp(timestamp, defect=None):
+    '''
+    '''
+    if defect == 'swapped_date':
+        return timestamp.strftime('%m.%d.%Y %H.%M.%S')
+
+    elif defect == 'swapped_date_both':
+        return '{}.{}.{}'.format(13 + timestamp.month % 12, 13 + timestamp.day % 15, timestamp.strftime('%Y %H.%M.%S'))
+
+    elif defect == 'us_timestamp':
+        return '{}-{}-{} {}'.format(timestamp.month, timestamp.day, timestamp.year, timestamp.strftime('%I.%M.%S %p').lstrip('0'))
+
+    elif defect == 'truncated_timestamp':
+        return timestamp.strftime('%d.%m.%Y')
+
+    return timestamp.strftime('%d.%m.%Y %H.%M.%S')
+
+def clio_text(serial, timestamp, results=None, defect=None, rng=None):
+    '''
+    Content of a CLIO file (CRLF line endings, as exported), results maps each sub-test and 'overall' to 'good' or 'bad'
+    '''
+    results = results if results is not None else dict.fromkeys(aux.SUBTESTS + ['overall'], 'good')
+    overall = results['overall'].upper()
+
+    subtests = ['   {} {}'.format(name, results[feature].upper()) for name, feature in zip(LINE_NAMES, aux.SUBTESTS)]
+    if defect == 'missing_subtest':
+        rng = rng or np.random.RandomState()
+        missing = set(rng.choice(len(subtests), rng.randint(1, len(subtests)), replace=False))
+        subtests = [x for i, x in enumerate(subtests) if i not in missing]
+
+    lines = ['1 {} SIN'.format(overall)] + subtests + [format_timestamp(timestamp, defect)]
+    if defect != 'missing_unit':
+        lines.append('UNIT N. {} {}'.format(serial, overall))
+
+    return '\r\n'.join(lines) + '\r\n'
+
+def write_clio_files(path, n_files, seed=0, defect_rate=0.02, archive=None, **kwargs):
+    '''
+    Writes n_files CLIO files in path (or in a single zip archive path/<archive> if given), a share (defect_rate) of
+    them with one of DEFECTS. Returns the ground truth of generate_results() with the defect of each file.
+    '''
+    rng = np.random.RandomState(seed + 1)
+    results = generate_results(n_files, seed=seed, **kwargs)
+
+    defects = np.where(rng.rand(n_files) < defect_rate, rng.choice(DEFECTS, n_files), None)
+    results['defect'] = defects
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    records = results[aux.SUBTESTS + ['overall']].to_dict('records')
+    files = zip(results.fname, results.serial, results.created_at, records, defects)
+
+    if archive:
+        with zipfile.ZipFile(os.path.join(path, archive), 'w', zipfile.ZIP_DEFLATED) as z:
+            for fname, serial, timestamp, record, defect in files:
+                z.writestr(fname, clio_text(serial, timestamp, record, defect, rng))
+
+    else:
+        for fname, serial, timestamp, record, defect in files:
+            with open(os.path.join(path, fname), 'w', newline='') as f:
+                f.write(clio_text(serial, timestamp, record, defect, rng))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes synthetic CLIO result files')
+    parser.add_argument('path', help='directory the files are written to')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--defect-rate', type=float, default=0.02, help='share of files with one of the known defects')
+    parser.add_argument('--fail-rate', type=float, default=0.03, help='probability of each sub-test failing')
+    parser.add_argument('--days', type=int, default=60, help='number of production days the files are spread over')
+    parser.add_argument('--archive', default=None, help='write a single zip archive with this name instead of loose files')
+    args = parser.parse_args()
+
+    truth = write_clio_files(args.path, args.files, seed=args.seed, defect_rate=args.defect_rate,
+                             archive=args.archive, fail_rate=args.fail_rate, days=args.days)
+    print('{} files written to {} ({} with defects)'.format(len(truth), args.path, truth.defect.notnull().sum()))